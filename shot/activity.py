@@ -0,0 +1,71 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+from PIL import Image
+from loguru import logger
+
+from shot.conf.model import Cam
+from shot.timelapse import thin
+from shot.workers import workers
+
+THUMB_SIZE = (32, 24)
+# part of the mean activity every frame gets, static stretches are thinned but not dropped
+STATIC_SHARE = 0.25
+
+
+def tiny(path: str) -> np.ndarray:
+    image = Image.open(path)
+    # JPEG is decoded at 1/8 scale right away
+    image.draft('L', (THUMB_SIZE[0] * 2, THUMB_SIZE[1] * 2))
+    return np.asarray(image.convert('L').resize(THUMB_SIZE, Image.BILINEAR), dtype=np.float32)
+
+
+def activity(sequence: Sequence[str]) -> np.ndarray:
+    """ Change of every frame from the previous one, mean absolute difference of tiny thumbnails
+    """
+    # Pillow releases GIL while decoding, so threads of io pool decode in parallel
+    stack = np.stack(list(workers.io.map(tiny, sequence)))
+    scores = np.empty(len(sequence), dtype=np.float32)
+    scores[1:] = np.abs(np.diff(stack, axis=0)).mean(axis=(1, 2))
+    scores[0] = scores[1:].max() if len(sequence) > 1 else 0
+    return scores
+
+
+def pick(scores: np.ndarray, budget: int) -> np.ndarray:
+    """ Indexes of at most `budget` frames, spaced evenly by cumulative activity
+
+    Busy stretches get dense sampling, static ones are sampled sparsely. First and last
+    frames are always kept.
+    """
+    weights = scores + max(float(scores.mean()) * STATIC_SHARE, 1e-6)
+    cumulative = np.cumsum(weights)
+    targets = (np.arange(budget) + 0.5) * cumulative[-1] / budget
+    indexes = np.unique(np.searchsorted(cumulative, targets))
+    indexes[0], indexes[-1] = 0, len(scores) - 1
+    return np.unique(indexes)
+
+
+def frame_budget(cam: Cam, fps: int, share: float = 1) -> Optional[int]:
+    """ Frames allowed in movie of camera, `share` is part of the day movie is made of
+    """
+    budgets = []
+    if cam.frame_budget:
+        budgets.append(cam.frame_budget)
+    if cam.target_duration:
+        budgets.append(int(cam.target_duration * fps))
+    if not budgets:
+        return None
+    return max(int(min(budgets) * share), 2)
+
+
+def select_active(sequence: List[str], budget: Optional[int]) -> List[str]:
+    if not budget or len(sequence) <= budget:
+        return sequence
+    try:
+        scores = activity(sequence)
+    except Exception:
+        logger.exception('Can not score frames activity, thinning evenly')
+        return thin(sequence, budget)
+    result = [sequence[i] for i in pick(scores, budget)]
+    logger.info(f'Selected {len(result)} of {len(sequence)} frames by activity')
+    return result
@@ -0,0 +1,408 @@
+""" Capture path load benchmark against local fake cameras
+
+    python -m shot.bench.capture run --cameras 20 --interval 5 --duration 120
+    python -m shot.bench.capture record --url http://cam/snapshot.jpg --count 50 --out rec/
+    python -m shot.bench.capture run --cameras 20 --replay rec/
+"""
+import argparse
+import asyncio
+import collections
+import io
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import aiohttp
+from PIL import Image
+from aiohttp import web
+from loguru import logger
+
+from shot import conf
+from shot.conf.model import Cam
+from shot.hls import grabbers
+from shot.scheduler import CaptureScheduler
+from shot.shooter import CamHandler
+from shot.workers import workers
+
+RECORD_INDEX = 'responses.json'
+
+
+@dataclass
+class CameraSpec:
+    latency: float = 0.05
+    jitter: float = 0.02
+    error_rate: float = 0.0
+    change_rate: float = 1.0
+    etag: bool = False
+
+
+@dataclass
+class Response:
+    file: str
+    status: int
+    headers: Dict[str, str]
+    latency: float
+
+
+def make_frames(resolution: str, count: int, quality: int) -> List[bytes]:
+    """ Distinct frames with gradient and noise, so they compress roughly like real scenes
+    """
+    size = tuple(int(i) for i in resolution.split('x'))
+    gradient = Image.linear_gradient('L').resize(size)
+    frames = []
+    for i in range(count):
+        noise = Image.effect_noise(size, 32 + i)
+        image = Image.merge('RGB', (gradient, noise, gradient.rotate(90 * i).resize(size)))
+        buf = io.BytesIO()
+        image.save(buf, format='JPEG', quality=quality)
+        frames.append(buf.getvalue())
+    return frames
+
+
+def load_replay(folder: Path):
+    with open(folder / RECORD_INDEX) as f:
+        responses = [Response(**item) for item in json.load(f)]
+    bodies = {r.file: (folder / r.file).read_bytes() for r in responses if r.file}
+    return responses, bodies
+
+
+class FakeCameras:
+    """ aiohttp app serving `/cam/<n>`, either synthetic frames or recorded responses
+    """
+
+    def __init__(self, spec: CameraSpec, frames: List[bytes], replay: Optional[str] = None, seed: int = 0):
+        self.spec = spec
+        self.frames = frames
+        self.responses, self.bodies = load_replay(Path(replay)) if replay else ([], {})
+        self.position: Dict[int, int] = collections.defaultdict(int)
+        self.random = random.Random(seed)
+
+    async def synthetic(self, n: int, request):
+        spec = self.spec
+        await asyncio.sleep(max(spec.latency + self.random.uniform(-spec.jitter, spec.jitter), 0))
+        if self.random.random() < spec.error_rate:
+            return web.Response(status=503, text='camera is busy')
+        if self.random.random() < spec.change_rate:
+            self.position[n] += 1
+        index = (self.position[n] + n) % len(self.frames)
+        headers = {}
+        if spec.etag:
+            headers['ETag'] = f'"{n}-{self.position[n]}"'
+            if request.headers.get('If-None-Match') == headers['ETag']:
+                return web.Response(status=304, headers=headers)
+        return web.Response(body=self.frames[index], content_type='image/jpeg', headers=headers)
+
+    async def replay(self, n: int, request):
+        # every camera starts at own position of the recording
+        response = self.responses[(self.position[n] + n) % len(self.responses)]
+        self.position[n] += 1
+        await asyncio.sleep(response.latency)
+        return web.Response(status=response.status, headers=response.headers, body=self.bodies.get(response.file))
+
+    async def handler(self, request):
+        n = int(request.match_info['n'])
+        if self.responses:
+            return await self.replay(n, request)
+        return await self.synthetic(n, request)
+
+    async def head(self, request):
+        return web.Response(status=200)
+
+
+def serve(port: int, spec: CameraSpec, frames: List[bytes], replay: Optional[str], ready):
+    """ Runs in own process, so server load does not show up in measured CPU
+    """
+    cameras = FakeCameras(spec, frames, replay)
+    app = web.Application()
+    app.router.add_route('HEAD', '/cam/{n}', cameras.head)
+    app.router.add_route('GET', '/cam/{n}', cameras.handler)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    runner = web.AppRunner(app, access_log=None)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    ready.set()
+    loop.run_forever()
+
+
+class FileGrabber:
+    """ Stand-in for HLS grabber which hands out frames from files on disk
+    """
+
+    def __init__(self, files: List[Path], change_rate: float, seed: int):
+        self.files = files
+        self.change_rate = change_rate
+        self.position = seed
+        self.random = random.Random(seed)
+
+    async def frame(self) -> Optional[bytes]:
+        if self.random.random() < self.change_rate:
+            self.position += 1
+        return self.files[self.position % len(self.files)].read_bytes()
+
+    async def stop(self):
+        pass
+
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.results = collections.Counter()
+
+
+recorder = Recorder()
+
+
+class BenchHandler(CamHandler):
+    """ Real capture path, latency is measured from tick to stored frame
+    """
+
+    async def get_img_and_sync(self, regular=True):
+        start = time.monotonic()
+        image = await super().get_img_and_sync(regular)
+        if image:
+            recorder.latencies.append(time.monotonic() - start)
+        return image
+
+    def count(self, result: str):
+        super().count(result)
+        recorder.results[result] += 1
+
+
+class BenchScheduler(CaptureScheduler):
+
+    @staticmethod
+    def is_active(now):
+        return True
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def proc_usage(pid: int):
+    """ CPU seconds and RSS bytes of process from /proc
+    """
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    with open(f'/proc/{pid}/statm') as f:
+        rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return cpu, rss
+
+
+class Usage:
+    """ Samples CPU and RSS of service process and pool workers, fake camera server is excluded
+    """
+
+    def __init__(self, exclude: int):
+        self.exclude = exclude
+        self.cpu: Dict[int, float] = {}
+        self.rss_max = {'main': 0, 'workers': 0}
+
+    def sample(self):
+        rss = {'main': 0, 'workers': 0}
+        pids = [os.getpid()] + [p.pid for p in multiprocessing.active_children() if p.pid != self.exclude]
+        for pid in pids:
+            try:
+                cpu, size = proc_usage(pid)
+            except (OSError, IndexError):
+                continue
+            self.cpu[pid] = cpu
+            rss['main' if pid == os.getpid() else 'workers'] += size
+        for key, value in rss.items():
+            self.rss_max[key] = max(self.rss_max[key], value)
+
+    def cpu_seconds(self):
+        main = self.cpu.get(os.getpid(), 0)
+        return main, sum(self.cpu.values()) - main
+
+    async def run(self, period=1):
+        while True:
+            self.sample()
+            await asyncio.sleep(period)
+
+
+async def run_bench(args) -> dict:
+    cams = []
+    for n in range(args.cameras + args.hls):
+        hls = n >= args.cameras
+        url = f'bench://hls{n}.m3u8' if hls else f'http://127.0.0.1:{args.port}/cam/{n}'
+        cams.append(Cam(
+            url, n, interval=args.interval, name=f'bench{n}', resize=args.resize,
+            phash_threshold=args.phash, overlap=args.overlap,
+        ))
+    if args.hls:
+        folder = Path(conf.root_dir) / 'hls'
+        folder.mkdir()
+        files = []
+        for i, frame in enumerate(make_frames(args.resolution, args.frames, args.quality)):
+            files.append(folder / f'{i}.jpg')
+            files[-1].write_bytes(frame)
+        for cam in cams[args.cameras:]:
+            grabbers[cam.name] = FileGrabber(files, args.change_rate, cam.offset)
+
+    handlers = [BenchHandler.from_journal(cam) for cam in cams]
+    scheduler = BenchScheduler(handlers)
+    usage = Usage(exclude=args.server_pid)
+    await workers.warm()
+    usage.sample()
+    cpu_start = usage.cpu_seconds()
+    sampler = asyncio.ensure_future(usage.run())
+    start = time.monotonic()
+    scheduler.start()
+    await asyncio.sleep(args.duration)
+    await scheduler.stop()
+    elapsed = time.monotonic() - start
+    sampler.cancel()
+    usage.sample()
+    cpu_end = usage.cpu_seconds()
+    stored = recorder.results['stored']
+    return {
+        'cameras': args.cameras,
+        'hls': args.hls,
+        'interval': args.interval,
+        'duration': round(elapsed, 2),
+        'captures': dict(recorder.results),
+        'latency': {
+            'p50': percentile(recorder.latencies, 50),
+            'p90': percentile(recorder.latencies, 90),
+            'p99': percentile(recorder.latencies, 99),
+            'max': max(recorder.latencies, default=0),
+        },
+        'fps': stored / elapsed,
+        'expected_fps': len(cams) / args.interval,
+        'missed_ticks': sum(scheduler.missed.values()),
+        'late': sum(handler.late for handler in handlers),
+        'cpu_percent': {
+            'main': (cpu_end[0] - cpu_start[0]) / elapsed * 100,
+            'workers': (cpu_end[1] - cpu_start[1]) / elapsed * 100,
+        },
+        'rss_max': usage.rss_max,
+        'pools': workers.metrics(),
+        'circuits': {handler.cam.name: handler.breaker.state for handler in handlers if handler.breaker.state != 'closed'},
+    }
+
+
+def report(result: dict):
+    latency = result['latency']
+    lines = [
+        f'cameras: {result["cameras"]} http + {result["hls"]} hls, interval {result["interval"]}s, '
+        f'duration {result["duration"]}s',
+        f'captures: ' + ', '.join(f'{k} {v}' for k, v in sorted(result['captures'].items())),
+        f'latency: p50 {latency["p50"]:.3f}s p90 {latency["p90"]:.3f}s p99 {latency["p99"]:.3f}s '
+        f'max {latency["max"]:.3f}s',
+        f'fps: {result["fps"]:.2f} of {result["expected_fps"]:.2f} expected',
+        f'missed ticks: {result["missed_ticks"]}, late captures: {result["late"]}',
+        f'cpu: main {result["cpu_percent"]["main"]:.1f}%, workers {result["cpu_percent"]["workers"]:.1f}%',
+        f'rss: main {result["rss_max"]["main"] / 2 ** 20:.1f}MB, workers {result["rss_max"]["workers"] / 2 ** 20:.1f}MB',
+    ]
+    for name, pool in result['pools'].items():
+        lines.append(f'{name} pool: wait avg {pool["wait_avg"]:.3f}s max {pool["wait_max"]:.3f}s, failed {pool["failed"]}')
+    if result['circuits']:
+        lines.append('open circuits: ' + ', '.join(f'{k} {v}' for k, v in result['circuits'].items()))
+    return '\n'.join(lines)
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as root:
+        conf.root_dir = root
+        conf.log_file = 'bench.log'
+        logger.configure(handlers=[{'sink': Path(root) / conf.log_file, 'level': 'DEBUG'}])
+        spec = CameraSpec(args.latency, args.jitter, args.error_rate, args.change_rate, args.etag)
+        frames = [] if args.replay else make_frames(args.resolution, args.frames, args.quality)
+        context = multiprocessing.get_context('spawn')
+        ready = context.Event()
+        server = context.Process(target=serve, args=(args.port, spec, frames, args.replay, ready), daemon=True)
+        server.start()
+        ready.wait(30)
+        args.server_pid = server.pid
+        try:
+            result = asyncio.get_event_loop().run_until_complete(run_bench(args))
+        finally:
+            server.terminate()
+            workers.shutdown()
+    print(report(result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+async def record(args):
+    """ Saves real camera responses with latency for replay
+    """
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    responses = []
+    async with aiohttp.ClientSession() as session:
+        for i in range(args.count):
+            start = time.monotonic()
+            async with session.get(args.url) as response:
+                body = await response.read()
+                latency = time.monotonic() - start
+            name = f'{i:05d}.jpg' if body else ''
+            if name:
+                (out / name).write_bytes(body)
+            headers = {k: v for k, v in response.headers.items() if k in ('Content-Type', 'ETag', 'Last-Modified')}
+            responses.append(asdict(Response(name, response.status, headers, latency)))
+            print(f'{i}: {response.status} {len(body)} bytes in {latency:.3f}s')
+            await asyncio.sleep(args.interval)
+    with open(out / RECORD_INDEX, 'w') as f:
+        json.dump(responses, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Capture path benchmark with local fake cameras')
+    commands = parser.add_subparsers(dest='command')
+    bench = commands.add_parser('run', help='run capture benchmark')
+    bench.add_argument('--cameras', type=int, default=10, help='number of http cameras')
+    bench.add_argument('--hls', type=int, default=0, help='number of file based hls cameras')
+    bench.add_argument('--interval', type=int, default=5, help='capture interval, seconds')
+    bench.add_argument('--duration', type=float, default=60, help='benchmark duration, seconds')
+    bench.add_argument('--resolution', default='1280x720', help='frame size of fake cameras')
+    bench.add_argument('--quality', type=int, default=85, help='jpeg quality of fake frames')
+    bench.add_argument('--frames', type=int, default=8, help='distinct frames per fake camera')
+    bench.add_argument('--latency', type=float, default=0.05, help='response latency, seconds')
+    bench.add_argument('--jitter', type=float, default=0.02, help='latency jitter, seconds')
+    bench.add_argument('--error-rate', type=float, default=0.0, help='share of 503 responses')
+    bench.add_argument('--change-rate', type=float, default=1.0, help='share of responses with new frame')
+    bench.add_argument('--etag', action='store_true', help='fake cameras support conditional requests')
+    bench.add_argument('--replay', help='folder with recorded responses to serve instead of synthetic frames')
+    bench.add_argument('--resize', help='Cam.resize of benchmarked cameras, e.g. 640x360')
+    bench.add_argument('--phash', type=int, help='Cam.phash_threshold of benchmarked cameras')
+    bench.add_argument('--overlap', default='skip', help='Cam.overlap of benchmarked cameras')
+    bench.add_argument('--port', type=int, default=8765, help='port of fake cameras server')
+    bench.add_argument('--json', help='write machine readable result to file')
+    rec = commands.add_parser('record', help='record real camera responses for replay')
+    rec.add_argument('--url', required=True, help='camera url')
+    rec.add_argument('--count', type=int, default=20, help='number of requests')
+    rec.add_argument('--interval', type=float, default=5, help='pause between requests, seconds')
+    rec.add_argument('--out', required=True, help='output folder')
+    args = parser.parse_args()
+    if args.command is None:
+        parser.print_help()
+        sys.exit(1)
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.command == 'record':
+        asyncio.get_event_loop().run_until_complete(record(args))
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
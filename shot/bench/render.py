@@ -0,0 +1,263 @@
+""" Render path benchmark on synthetic day folders
+
+    python -m shot.bench.render --frames 1000 --resolution 1280x720 --gray 0.05 --corrupt 0.01
+    python -m shot.bench.render --cases movie,weekly --backends ffmpeg --json render.json
+
+Every case runs in fresh process on fresh copy of generated days, process tree of the case
+(render workers, ffmpeg) is sampled for peak RSS and number of subprocesses.
+"""
+import argparse
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from PIL import Image
+from loguru import logger
+
+from shot import conf
+from shot.bench.capture import make_frames
+from shot.conf.model import Cam
+from shot.conf.utils import root_directory
+from shot.timelapse import DAY_FORMAT
+
+CAM_NAME = 'bench'
+# cases which run with every backend, legacy is moviepy only
+BACKEND_CASES = ('movie', 'pool', 'weekly', 'incremental')
+CASES = BACKEND_CASES + ('legacy',)
+
+
+@dataclass
+class CaseResult:
+    case: str
+    backend: str
+    seconds: float = 0
+    frames: int = 0
+    encode_fps: float = 0
+    output_bytes: int = 0
+    rss_max: int = 0
+    subprocesses: int = 0
+    error: Optional[str] = None
+
+
+def frame_name(day: datetime.date, second: int) -> str:
+    return f'{day.strftime(DAY_FORMAT)}_{second // 3600:02d}-{second % 3600 // 60:02d}-{second % 60:02d}.jpg'
+
+
+def make_gray(resolution: str, quality: int) -> bytes:
+    image = Image.open(io.BytesIO(make_frames(resolution, 1, quality)[0])).convert('L')
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG', quality=quality)
+    return buf.getvalue()
+
+
+def make_days(root: Path, args) -> List[str]:
+    """ Day folders ending today with `frames` frames spread over capture hours
+
+    Shares of frames are saved as grayscale or truncated, like cameras sometimes return them.
+    """
+    rng = random.Random(args.seed)
+    frames = make_frames(args.resolution, args.distinct, args.quality)
+    gray = make_gray(args.resolution, args.quality)
+    start, end = conf.capture_start * 3600, conf.capture_end * 3600
+    step = (end - start) / args.frames
+    today = datetime.date.today()
+    days = []
+    for offset in range(args.days - 1, -1, -1):
+        day = today - datetime.timedelta(days=offset)
+        folder = root / 'data' / CAM_NAME / 'regular' / 'imgs' / day.strftime(DAY_FORMAT)
+        folder.mkdir(parents=True)
+        for i in range(args.frames):
+            data = frames[i % len(frames)]
+            if rng.random() < args.gray:
+                data = gray
+            if rng.random() < args.corrupt:
+                data = data[:len(data) // 2]
+            (folder / frame_name(day, int(start + i * step))).write_bytes(data)
+        days.append(day.strftime(DAY_FORMAT))
+    # timestamps font is read from repository when it is not installed
+    (root / 'fonts').symlink_to(Path(root_directory()) / 'fonts')
+    return days
+
+
+def run_case(case: str, backend: str, root: str, day: str, conn):
+    """ Case body, runs in spawned process with `root` as root_dir
+    """
+    from shot import movie, shooter
+    from shot.render import renderer
+    conf.root_dir = root
+    logger.configure(handlers=[{'sink': Path(root) / 'bench.log', 'level': 'DEBUG'}])
+    cam = Cam('bench://', 0, name=CAM_NAME, backend=backend, incremental=case == 'incremental')
+    conf.cameras = {cam.name: cam}
+    conf.cameras_list = [cam]
+    movie.warm()
+    folder = Path(root) / 'data' / cam.name / 'regular' / 'imgs' / day
+    result = CaseResult(case, backend)
+    start = time.monotonic()
+    try:
+        if case == 'legacy':
+            clip = shooter._make_movie(cam, day)
+        elif case == 'pool':
+            clip = shooter.make_movie(cam, day)
+        elif case == 'weekly':
+            clip = shooter.make_weekly_movie(cam)
+        else:
+            clip = movie.make_movie(cam, day)
+        result.seconds = time.monotonic() - start
+        result.frames = clip.frames or sum(1 for _ in folder.iterdir())
+        result.encode_fps = result.frames / result.seconds
+        result.output_bytes = Path(clip.path).stat().st_size
+    except Exception as exc:
+        logger.exception(f'Error in {case} case')
+        result.seconds = time.monotonic() - start
+        result.error = f'{exc.__class__.__name__}: {exc}'[:500]
+    finally:
+        renderer.shutdown()
+    conn.send(asdict(result))
+
+
+def process_tree(pid: int) -> Dict[int, int]:
+    """ RSS bytes of process and all its descendants
+    """
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, queue = {}, [pid]
+    while queue:
+        current = queue.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                tree[current] = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except OSError:
+            continue
+        queue.extend(child for child, parent in parents.items() if parent == current)
+    return tree
+
+
+class TreeSampler(threading.Thread):
+
+    def __init__(self, pid: int, period: float):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.period = period
+        self.rss_max = 0
+        self.seen: Set[int] = set()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            tree = process_tree(self.pid)
+            self.rss_max = max(self.rss_max, sum(tree.values()))
+            self.seen.update(tree)
+            self.stopped.wait(self.period)
+
+
+def measure(case: str, backend: str, template: Path, work: Path, day: str, period: float) -> dict:
+    root = work / f'{case}-{backend}'
+    shutil.copytree(template, root, symlinks=True)
+    context = multiprocessing.get_context('spawn')
+    parent, child = context.Pipe()
+    proc = context.Process(target=run_case, args=(case, backend, str(root), day, child), name=f'bench-{case}')
+    proc.start()
+    child.close()
+    sampler = TreeSampler(proc.pid, period)
+    sampler.start()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = asdict(CaseResult(case, backend, error=f'case process died with {proc.exitcode}'))
+    proc.join()
+    sampler.stopped.set()
+    sampler.join()
+    result['rss_max'] = sampler.rss_max
+    result['subprocesses'] = len(sampler.seen - {proc.pid})
+    shutil.rmtree(root, ignore_errors=True)
+    return result
+
+
+def report(result: dict) -> str:
+    params = result['params']
+    lines = [
+        f'{params["days"]} days of {params["frames"]} frames {params["resolution"]}, '
+        f'gray {params["gray"]}, corrupt {params["corrupt"]}',
+        f'{"case":<12} {"backend":<8} {"seconds":>8} {"frames":>7} {"fps":>8} {"size MB":>8} {"rss MB":>8} {"procs":>5}',
+    ]
+    for case in result['cases']:
+        if case['error']:
+            lines.append(f'{case["case"]:<12} {case["backend"]:<8} failed: {case["error"].splitlines()[0][:80]}')
+            continue
+        lines.append(
+            f'{case["case"]:<12} {case["backend"]:<8} {case["seconds"]:>8.2f} {case["frames"]:>7} '
+            f'{case["encode_fps"]:>8.1f} {case["output_bytes"] / 2 ** 20:>8.2f} {case["rss_max"] / 2 ** 20:>8.1f} '
+            f'{case["subprocesses"]:>5}'
+        )
+    return '\n'.join(lines)
+
+
+def run(args):
+    cases = [case for case in args.cases.split(',') if case]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        sys.exit(f'Unknown cases {", ".join(sorted(unknown))}, use {", ".join(CASES)}')
+    if 'weekly' in cases:
+        args.days = max(args.days, 7)
+    with tempfile.TemporaryDirectory() as tmp:
+        template = Path(tmp) / 'template'
+        days = make_days(template, args)
+        results = []
+        for case in cases:
+            for backend in (args.backends.split(',') if case in BACKEND_CASES else ['moviepy']):
+                print(f'Running {case} with {backend}..', file=sys.stderr)
+                results.append(measure(case, backend, template, Path(tmp), days[-1], args.sample))
+    result = {
+        'params': {k: v for k, v in vars(args).items() if k not in ('json', 'sample')},
+        'host': {'cpus': os.cpu_count(), 'python': platform.python_version(), 'machine': platform.machine()},
+        'started': datetime.datetime.now().isoformat(),
+        'cases': results,
+    }
+    print(report(result))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Render path benchmark on synthetic day folders')
+    parser.add_argument('--cases', default='movie,legacy,pool,weekly', help=f'comma separated of {", ".join(CASES)}')
+    parser.add_argument('--backends', default='moviepy,ffmpeg', help='render backends of cases, comma separated')
+    parser.add_argument('--frames', type=int, default=500, help='frames per day')
+    parser.add_argument('--days', type=int, default=1, help='days of frames, at least 7 with weekly case')
+    parser.add_argument('--resolution', default='1280x720', help='frame size')
+    parser.add_argument('--quality', type=int, default=85, help='jpeg quality of frames')
+    parser.add_argument('--distinct', type=int, default=16, help='distinct frames repeated over the day')
+    parser.add_argument('--gray', type=float, default=0.0, help='share of grayscale frames')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='share of truncated frames')
+    parser.add_argument('--seed', type=int, default=0, help='seed of gray and corrupt frames choice')
+    parser.add_argument('--sample', type=float, default=0.1, help='process tree sampling period, seconds')
+    parser.add_argument('--json', help='write machine readable result to file')
+    return parser.parse_args()
+
+
+def main():
+    run(parse_args())
+
+
+if __name__ == '__main__':
+    main()
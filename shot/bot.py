@@ -1,8 +1,8 @@
 import asyncio
-import concurrent
 import dataclasses
 import datetime
 import shutil
+import time
 from pathlib import Path
 
 import pendulum
@@ -10,22 +10,76 @@ from aiotg import Bot, BotApiError, Chat
 from aiotg.bot import RETRY_CODES, RETRY_TIMEOUT
 from loguru import logger
 
-from shot import conf
+from shot import conf, metrics
+from shot.breaker import CLOSED, OPEN, breakers, on_state_change
+from shot.cache import ResultCache
 from shot.conf.model import Cam
+from shot.jobs import BACKFILL, INTERACTIVE, SCHEDULED, render_queue
+from shot.journal import get_state
 from shot.keyboards import CamerasChannel, InlineKeyboardButton, Markup, Menu
 from shot.model import Admin, Channel, PhotoChannel, db
 from shot.model.helpers import ThreadSwitcherWithDB, db_in_thread
-from shot.shooter import CamHandler, clear_cam_storage, make_movie, make_weekly_movie, stats
+from shot.shooter import CamHandler, clear_cam_storage, stats
+from shot.sidecar import read_sidecar
+from shot.timelapse import PRESETS
 from shot.utils import convert_size
+from shot.workers import workers
 
 CUSTOM_API_URL = "http://telegram-bot-api:8081"
 
+# file ids of uploaded videos, the same file is sent again without upload
+uploads = ResultCache(conf.render_cache_size * 4, conf.render_cache_ttl)
+
+
+def sent_file_id(response):
+    result = (response or {}).get('result') or {}
+    for kind in 'video', 'animation', 'document':
+        if kind in result:
+            return result[kind].get('file_id')
+
+
+async def upload_video(chat, path, **options):
+    stat = Path(path).stat()
+    version = stat.st_size, stat.st_mtime_ns
+    file_id = uploads.get(str(path), version)
+    if file_id is not None:
+        try:
+            await chat.send_video(file_id, **{k: v for k, v in options.items() if k != 'thumb'})
+        except BotApiError:
+            logger.warning(f'Can not send {path} by file id, uploading it')
+            uploads.invalidate(str(path))
+        else:
+            metrics.upload_cached.inc()
+            return
+    start = time.monotonic()
+    with open(path, 'rb') as video:
+        response = await chat.send_video(video, **options)
+    metrics.upload_bytes.inc(stat.st_size)
+    metrics.upload_speed.set(stat.st_size / max(time.monotonic() - start, 1e-6))
+    file_id = sent_file_id(response)
+    if file_id:
+        uploads.put(str(path), version, file_id)
+
+
+async def send_clip(chat, path: Path):
+    """ Sends clip with dimensions, duration and thumbnail from its sidecar
+    """
+    meta = read_sidecar(path)
+    if meta is None:
+        await upload_video(chat, path, supports_streaming='true')
+        return
+    options = dict(
+        supports_streaming='true', width=str(meta.width), height=str(meta.height), duration=str(round(meta.duration)),
+    )
+    if not meta.thumb or not (path.parent / meta.thumb).exists():
+        await upload_video(chat, path, **options)
+        return
+    with open(path.parent / meta.thumb, 'rb') as thumb:
+        await upload_video(chat, path, thumb=thumb, **options)
+
+
 async def send_video(chat, clip):
-    with open(clip.path, 'rb') as _clip, open(clip.thumb, 'rb') as thumb:
-        await chat.send_video(
-            _clip, supports_streaming='true',
-            width=str(clip.width), height=str(clip.height), thumb=thumb
-        )
+    await send_clip(chat, clip.path)
 
 
 async def unhandled_callbacks(chat, cq):
@@ -50,9 +104,7 @@ async def regular_handler(chat, cam_name):
     if not clip.exists():
         await chat.send_text(f'Can not find regular clip for {day}!')
         return
-    # TODO load metadata from path
-    with open(clip, 'rb') as clip:
-        await chat.send_video(clip)
+    await send_clip(chat, clip)
 
 
 async def regular(chat, cq, match):
@@ -70,9 +122,7 @@ async def today_handler(chat, cam_name):
     if not cam:
         return
     today = datetime.datetime.now().strftime('%d_%m_%Y')
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        clip = await loop.run_in_executor(pool, lambda: make_movie(cam, today, regular=False))
+    clip = await render_queue.submit('today', cam, today, priority=INTERACTIVE, chat_id=chat.id)
     await send_video(chat, clip)
 
 
@@ -81,9 +131,7 @@ async def weekly(chat: Chat, cq, match):
     cam = await get_cam(match.group(1), chat)
     if not cam:
         return
-    loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        clip = await loop.run_in_executor(pool, lambda: make_weekly_movie(cam, pool))
+    clip = await render_queue.submit('weekly', cam, priority=INTERACTIVE, chat_id=chat.id)
     await send_video(chat, clip)
 
 
@@ -117,7 +165,8 @@ class Bot_(Bot):
         url = "{0}/bot{1}/{2}".format(CUSTOM_API_URL, self.api_token, method)
         logger.debug("api_call %s, %s", method, params)
 
-        response = await self.session.post(url, data=params)
+        with metrics.telegram_seconds.time(method=method):
+            response = await self.session.post(url, data=params)
 
         if response.status == 200:
             return await response.json(loads=self.json_deserialize)
@@ -128,6 +177,7 @@ class Bot_(Bot):
                 RETRY_TIMEOUT,
             )
             await response.release()
+            metrics.telegram_retries.inc(method=method)
             await asyncio.sleep(RETRY_TIMEOUT)
             return await self.api_call(method, **params)
         else:
@@ -184,9 +234,11 @@ class CamBot:
         self.loop = self._bot.loop
         self.menu_markup = Menu()
         self.init_handlers()
+        on_state_change(self.circuit_changed)
 
     def init_handlers(self):
         self._bot.add_command(r'/mov (.+) (.+)', self.mov)
+        self._bot.add_command(r'/lapse (.+) (.+)', self.timelapse_command)
         self._bot.add_command(r'/clear (.+)', self.clear_command)
         self._bot.add_command(r'/reg', reg)
         self._bot.add_command(r'/ch', self.reg_channel)
@@ -221,24 +273,21 @@ class CamBot:
         await self.stats_request(pendulum.yesterday(), self.notify_admins)
 
     @ThreadSwitcherWithDB.optimized
-    async def daily_movie(self, cam: Cam):
-        day = datetime.datetime.now()
-        day = day.strftime('%d_%m_%Y')
-        loop = asyncio.get_event_loop()
+    async def daily_movie(self, cam: Cam, day: str = None, priority: int = SCHEDULED):
+        day = day or datetime.datetime.now().strftime('%d_%m_%Y')
         clear_data = False
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            try:
-                clip = await loop.run_in_executor(pool, lambda: make_movie(cam, day))
-            except FileNotFoundError as exc:
-                logger.exception(exc)
-                await self.notify_admins(f'File {exc.filename} not found for daily movie {cam.name}: {day}')
-                return
-            except Exception as exc:
-                logger.exception(exc)
-                await self.notify_admins(f'Error during making daily movie for {cam.name}: {day}')
-                return
-            else:
-                clear_data = True
+        try:
+            clip = await render_queue.submit('daily', cam, day, priority=priority)
+        except FileNotFoundError as exc:
+            logger.exception(exc)
+            await self.notify_admins(f'File {exc.filename} not found for daily movie {cam.name}: {day}')
+            return
+        except Exception as exc:
+            logger.exception(exc)
+            await self.notify_admins(f'Error during making daily movie for {cam.name}: {day}')
+            return
+        else:
+            clear_data = True
         if cam.update_channel:
             async with db_in_thread():
                 channels = db.query(Channel).filter(Channel.cam == cam.name).all()
@@ -254,7 +303,7 @@ class CamBot:
             await send_video(Chat(self._bot, chat.chat_id), clip)
         if clear_data:
             try:
-                await loop.run_in_executor(None, lambda: clear_cam_storage(day, cam))
+                await workers.run_io(clear_cam_storage, day, cam)
             except Exception:
                 logger.exception(f'Error during clear {cam.name} -- {day}')
             else:
@@ -271,32 +320,84 @@ class CamBot:
         if not cam:
             return
         day = match.group(2)
-        loop = asyncio.get_event_loop()
-        with concurrent.futures.ThreadPoolExecutor() as pool:
-            try:
-                clip = await loop.run_in_executor(pool, lambda: make_movie(cam, day))
-            except Exception:
-                logger.exception('Error during movie request')
-                await self.notify_admins(f'Error during movie request {day} {cam.name}')
-                return
+        try:
+            clip = await render_queue.submit('daily', cam, day, priority=INTERACTIVE, chat_id=chat.id)
+        except Exception:
+            logger.exception('Error during movie request')
+            await self.notify_admins(f'Error during movie request {day} {cam.name}')
+            return
         await self.notify_admins(f'Video ready. Uploading..')
-        with open(clip.path, 'rb') as clip:
-            await chat.send_video(clip)
+        await send_video(chat, clip)
+
+    async def timelapse_command(self, chat, match):
+        """
+        Make long range movie for specified cam. Example: /lapse favcam monthly
+        :param chat:
+        :param match:
+        :return:
+        """
+        cam = await get_cam(match.group(1), chat)
+        if not cam:
+            return
+        preset = match.group(2)
+        if preset not in PRESETS:
+            await chat.send_text(f'Unknown timelapse {preset}, use one of: {", ".join(PRESETS)}')
+            return
+        try:
+            clip = await render_queue.submit('timelapse', cam, preset=preset, priority=INTERACTIVE, chat_id=chat.id)
+        except Exception:
+            logger.exception(f'Error during {preset} movie request')
+            await chat.send_text(f'Error during {preset} movie request {cam.name}')
+            return
+        await send_video(chat, clip)
 
     async def daily_movie_group(self):
-        for cam in sorted(conf.cameras_list, key=lambda k: k.offset):
-            if cam.render_daily:
-                try:
-                    await self.daily_movie(cam)
-                except Exception:
-                    err = f'Error during preparing daily movie for {cam.name}!'
-                    logger.exception(err)
-                    await self.notify_admins(err)
+        # cameras are rendered in parallel, render queue limits how many at once
+        cams = [cam for cam in sorted(conf.cameras_list, key=lambda k: k.offset) if cam.render_daily]
+        await asyncio.gather(*(self._daily_movie(cam) for cam in cams))
         # await self.daily_stats()
 
+    async def _daily_movie(self, cam: Cam, day: str = None, priority: int = SCHEDULED):
+        try:
+            await self.daily_movie(cam, day, priority)
+        except Exception:
+            err = f'Error during preparing daily movie for {cam.name}!'
+            logger.exception(err)
+            await self.notify_admins(err)
+
+    async def backfill(self):
+        """ Daily movies of days missed while service was down
+        """
+        jobs = []
+        for cam in conf.cameras_list:
+            if not cam.render_daily:
+                continue
+            try:
+                days = await render_queue.missed_days(cam)
+            except Exception:
+                logger.exception(f'Can not find missed days of {cam.name}')
+                continue
+            for day in days:
+                logger.info(f'Backfilling daily movie {cam.name}: {day}')
+                jobs.append(self._daily_movie(cam, day, BACKFILL))
+        await asyncio.gather(*jobs)
+
+    async def segments_group(self):
+        # closed hours are encoded during the day, so daily movie only joins them;
+        # backfill priority keeps it behind requested movies, one job per camera at a time
+        day = datetime.datetime.now().strftime('%d_%m_%Y')
+        cams = [cam for cam in sorted(conf.cameras_list, key=lambda k: k.offset) if cam.incremental]
+        await asyncio.gather(*(self._segments(cam, day) for cam in cams))
+
+    async def _segments(self, cam: Cam, day: str):
+        try:
+            await render_queue.submit('segments', cam, day, priority=BACKFILL)
+        except Exception:
+            logger.exception(f'Error during encoding segments for {cam.name}: {day}')
+
     async def daily_photo_group(self):
         for cam in conf.cameras_list:
-            image = await CamHandler(cam, self._bot.session).get_img(regular=False)
+            image = await CamHandler(cam).get_img(regular=False)
             if not image:
                 await self.notify_admins(f'Error during image request for {cam.name}')
                 continue
@@ -312,7 +413,7 @@ class CamBot:
             await self.img_handler(chat, cam)
 
     async def img_handler(self, chat: Chat, cam):
-        image = await CamHandler(cam, self._bot.session).get_img(regular=False)
+        image = await CamHandler(cam).get_img(regular=False)
         if not image:
             await chat.send_text(f'Error during image request for {cam.name}')
             return
@@ -407,6 +508,16 @@ class CamBot:
         for admin in admins:
             await self._bot.send_message(admin.chat_id, text, **options)
 
+    async def circuit_changed(self, breaker, old, new):
+        # probes of dead camera flip open/half-open, admins hear only about down and back
+        try:
+            if old == CLOSED and new == OPEN:
+                await self.notify_admins(f'Camera {breaker.name} is down after {breaker.failures} failed captures')
+            elif new == CLOSED:
+                await self.notify_admins(f'Camera {breaker.name} is back online')
+        except Exception:
+            logger.exception(f'Can not notify admins about {breaker.name} circuit')
+
     @ThreadSwitcherWithDB.optimized
     async def admin_chats(self):
         async with db_in_thread():
@@ -473,8 +584,7 @@ class CamBot:
         await send_command('\n'.join(markdown_result), parse_mode='Markdown', reply_markup=markup.to_json())
 
     async def stats_handler(self, day=None):
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, lambda: stats(day))
+        result = await workers.run_io(stats, day)
         markdown_result = [f'#stats *{day.format("DD/MM/YYYY")}*']
         for d in result['cameras']:
             stat = result['cameras'][d]
@@ -491,8 +601,7 @@ class CamBot:
         return markdown_result
 
     async def local_stats_handler(self, day=None):
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(None, lambda: stats(day))
+        result = await workers.run_io(stats, day)
         markdown_result = [f'#stats *{day.format("DD/MM/YYYY")}*']
         for d in result['cameras']:
             stat = result['cameras'][d]
@@ -506,14 +615,37 @@ class CamBot:
         markdown_result.append(f'*total*: {total}')
         free = convert_size(result['free'])
         markdown_result.append(f'*free*: {free}')
+        for name, pool in workers.metrics().items():
+            markdown_result.append(
+                f'*{name} pool*: {pool["pending"]}/{pool["size"]} - queue {pool["queue_depth"]} - '
+                f'wait {pool["wait_avg"]:.2f}s (max {pool["wait_max"]:.2f}s)'
+            )
+        queue = render_queue.stats()
+        markdown_result.append(
+            f'*render queue*: {queue["running"]}/{queue["limit"]} - pending {queue["pending"]} - '
+            f'cached {queue["cached"]}'
+        )
+        for cam in conf.cameras_list:
+            state = get_state(cam)
+            if state.not_modified or state.validators_ignored:
+                markdown_result.append(
+                    f'*{cam.name} validators*: not modified {state.not_modified} - ignored {state.validators_ignored}'
+                )
+        for name, breaker in breakers.items():
+            health = f'*{name} health*: {breaker.state}'
+            if breaker.state != CLOSED:
+                since = datetime.datetime.fromtimestamp(breaker.changed).strftime('%H:%M:%S')
+                health += f' since {since} - next probe in {breaker.retry_in:.0f}s'
+            elif breaker.failures:
+                health += f' - {breaker.failures} failures'
+            markdown_result.append(health)
         return markdown_result
 
     async def clear_handler(self, chat, day):
         logger.info(f'Going to clear for {day}')
-        loop = asyncio.get_event_loop()
         for cam in conf.cameras_list:
             try:
-                await loop.run_in_executor(None, lambda: clear_cam_storage(day, cam))
+                await workers.run_io(clear_cam_storage, day, cam)
             except Exception:
                 logger.exception(f'Error during clear {cam.name} -- {day}')
                 await chat.send_text(f'Error {cam.name} — {day}')
@@ -0,0 +1,103 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List
+
+from loguru import logger
+
+from shot import metrics
+from shot.conf.model import Cam
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+@dataclass
+class CircuitBreaker:
+    """ Stops polling dead camera and probes it with exponential backoff
+
+    closed -- camera is polled every tick, `threshold` consecutive failures open the circuit;
+    open -- ticks are skipped until `retry_at`; half-open -- single probe is let through,
+    success closes the circuit, failure opens it again with doubled delay.
+    """
+    name: str
+    threshold: int = 5
+    delay: float = 60
+    max_delay: float = 3600
+    state: str = CLOSED
+    failures: int = 0
+    openings: int = 0
+    retry_at: float = 0
+    changed: float = field(default_factory=time.time)
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        if self.state == OPEN:
+            self._transition(HALF_OPEN)
+        # probe holds the lease for `delay`, so lost probe does not block camera forever
+        self.retry_at = now + self.delay
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.openings = 0
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            self.openings += 1
+            self.retry_at = time.monotonic() + self.backoff
+            self._transition(OPEN)
+
+    @property
+    def backoff(self) -> float:
+        return min(self.delay * 2 ** max(self.openings - 1, 0), self.max_delay)
+
+    @property
+    def retry_in(self) -> float:
+        return max(self.retry_at - time.monotonic(), 0)
+
+    def _transition(self, state: str):
+        old, self.state = self.state, state
+        self.changed = time.time()
+        if state == OPEN:
+            logger.warning(f'Circuit for {self.name} is open after {self.failures} failures, '
+                           f'next probe in {self.backoff:.0f}s')
+        else:
+            logger.info(f'Circuit for {self.name}: {old} -> {state}')
+        for listener in listeners:
+            asyncio.ensure_future(listener(self, old, state))
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+listeners: List[Callable[[CircuitBreaker, str, str], Awaitable[None]]] = []
+
+
+def get_breaker(cam: Cam) -> CircuitBreaker:
+    if cam.name not in breakers:
+        breakers[cam.name] = CircuitBreaker(
+            cam.name, threshold=cam.breaker_threshold, delay=cam.breaker_delay, max_delay=cam.breaker_max_delay,
+        )
+    return breakers[cam.name]
+
+
+def on_state_change(func):
+    """ Listener is awaited in background on every transition with breaker, old and new state
+    """
+    listeners.append(func)
+    return func
+
+
+@metrics.register_collector
+def collect_breakers():
+    for name, breaker in breakers.items():
+        metrics.camera_circuit_state.set(STATE_VALUES[breaker.state], cam=name)
+        metrics.camera_failures.set(breaker.failures, cam=name)
@@ -0,0 +1,48 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, Optional
+
+
+@dataclass
+class CacheEntry:
+    version: Hashable
+    value: Any
+    stored: float
+
+
+class ResultCache:
+    """ LRU cache of finished results
+
+    Entry is valid only for `version` of its inputs, e.g. frame count of the day, and not
+    longer than `ttl` seconds. Least recently used entries are evicted over `size`.
+    """
+
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._items: 'OrderedDict[Hashable, CacheEntry]' = OrderedDict()
+
+    def get(self, key: Hashable, version: Hashable = None) -> Optional[Any]:
+        """ Cached value, `version` None accepts any version of entry
+        """
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry.stored > self.ttl or (version is not None and entry.version != version):
+            del self._items[key]
+            return None
+        self._items.move_to_end(key)
+        return entry.value
+
+    def put(self, key: Hashable, version: Hashable, value: Any):
+        self._items[key] = CacheEntry(version, value, time.monotonic())
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,115 @@
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import aiohttp
+from loguru import logger
+
+from shot import conf, metrics
+from shot.conf.model import Cam
+
+
+def _cam_label(ctx: SimpleNamespace) -> str:
+    return (ctx.trace_request_ctx or {}).get('cam', 'unknown')
+
+
+async def on_request_start(session, ctx, params):
+    ctx.start = time.monotonic()
+
+
+async def on_dns_resolvehost_start(session, ctx, params):
+    ctx.dns_start = time.monotonic()
+
+
+async def on_dns_resolvehost_end(session, ctx, params):
+    metrics.http_seconds.observe(time.monotonic() - ctx.dns_start, cam=_cam_label(ctx), phase='dns')
+
+
+async def on_connection_create_start(session, ctx, params):
+    ctx.connect_start = time.monotonic()
+
+
+async def on_connection_create_end(session, ctx, params):
+    metrics.http_seconds.observe(time.monotonic() - ctx.connect_start, cam=_cam_label(ctx), phase='connect')
+    metrics.http_connections.inc(cam=_cam_label(ctx), kind='new')
+
+
+async def on_connection_reuseconn(session, ctx, params):
+    metrics.http_connections.inc(cam=_cam_label(ctx), kind='reused')
+
+
+async def on_request_end(session, ctx, params):
+    metrics.http_seconds.observe(time.monotonic() - ctx.start, cam=_cam_label(ctx), phase='headers')
+
+
+def trace_config() -> aiohttp.TraceConfig:
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+    trace.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    trace.on_connection_create_start.append(on_connection_create_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+class CamClient:
+    """ HTTP client for camera fetches, separate from Telegram bot session
+
+    Own connector keeps camera connections alive with per-host limit and DNS cache,
+    so large uploads to Telegram do not compete with frame fetches for connections.
+    """
+
+    def __init__(self):
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # created lazily to be bound to running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=conf.http_limit,
+                limit_per_host=conf.http_limit_per_host,
+                ttl_dns_cache=conf.http_dns_ttl,
+                keepalive_timeout=conf.http_keepalive,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[trace_config()],
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._session
+
+    @staticmethod
+    def timeout(cam: Cam) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=cam.timeout, sock_connect=cam.connect_timeout, sock_read=cam.read_timeout)
+
+    async def get(self, cam: Cam, headers=None) -> aiohttp.ClientResponse:
+        return await self.session.get(
+            cam.url, headers=headers, timeout=self.timeout(cam), trace_request_ctx={'cam': cam.name}
+        )
+
+    def needs_prewarm(self, cam: Cam) -> bool:
+        # connection of camera polled more often than keep-alive is still in pool
+        return cam.prewarm and not cam.url.endswith('m3u8') and cam.interval > conf.http_keepalive
+
+    async def prewarm(self, cam: Cam):
+        """ Opens connection to camera ahead of the tick, it goes back to pool for the next fetch
+        """
+        try:
+            response = await self.session.head(
+                cam.url, allow_redirects=False, timeout=self.timeout(cam),
+                trace_request_ctx={'cam': cam.name},
+            )
+            await response.release()
+        except Exception as exc:
+            logger.debug(f'Prewarm failed for {cam.name}: {exc!r}')
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+cam_client = CamClient()
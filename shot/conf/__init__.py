@@ -15,6 +15,24 @@ cameras_list: Optional[List[Cam]] = None
 tele_proxy: Optional[str] = None
 root_dir: Optional[str] = None
 google_photos: Optional[GooglePhotos] = None
+capture_start: int = 5
+capture_end: int = 22
+cpu_workers: Optional[int] = None
+io_workers: Optional[int] = None
+cam_jobs: int = 2
+metrics_port: Optional[int] = 8080
+http_limit: int = 100
+http_limit_per_host: int = 2
+http_keepalive: float = 30
+http_dns_ttl: Optional[int] = 300
+render_workers: Optional[int] = None
+render_job_memory: int = 512
+backfill_days: int = 3
+render_cache_size: int = 32
+render_cache_ttl: int = 6 * 3600
+render_max_rss: int = 1024
+render_timeout: int = 3600
+font_file: str = '/usr/local/share/fonts/Ubuntu/Ubuntu-Bold.ttf'
 
 
 def read():
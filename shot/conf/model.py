@@ -3,6 +3,20 @@ from typing import Dict, List, Optional
 
 from dataclasses_json import dataclass_json
 
+from shot.phash import HASHES
+
+# Cam.overlap: tick which comes while capture is still running
+OVERLAP_POLICIES = ('skip', 'coalesce', 'queue')
+# Cam.backend: encoder of movies
+BACKENDS = ('moviepy', 'ffmpeg')
+
+
+def check_choice(cam: str, field: str, value: str, choices):
+    """ Misspelled option should stop startup instead of silently falling back to default
+    """
+    if value not in choices:
+        raise ValueError(f'Unknown {field} {value!r} of camera {cam}, use one of: {", ".join(choices)}')
+
 
 class LightWeightToDictMixin:
 
@@ -36,6 +50,27 @@ class GooglePhotos:
     handle_album_timeout: int = 3 * 60
 
 
+@dataclass_json
+@dataclass
+class EncodeProfile:
+    """ Encoder settings of camera movies
+
+    Quality is set by `crf` or fixed `bitrate` (e.g. '4M'). With `target_size` (MB) bitrate
+    is computed from duration of movie so file fits upload limit, `two_pass` makes the
+    size more exact for the cost of second encode.
+    """
+    codec: str = 'libx264'
+    crf: Optional[int] = 23
+    bitrate: Optional[str] = None
+    preset: str = 'medium'
+    tune: Optional[str] = 'stillimage'
+    max_width: Optional[int] = None
+    max_height: Optional[int] = None
+    faststart: bool = True
+    target_size: Optional[int] = None
+    two_pass: bool = False
+
+
 @dataclass_json
 @dataclass
 class Cam:
@@ -49,6 +84,25 @@ class Cam:
     name: Optional[str] = None
     resize: Optional[str] = None
     description: Optional[str] = None
+    hls_persistent: bool = True
+    hls_fps: int = 1
+    max_size: int = 20 * 1024 * 1024
+    read_timeout: int = 30
+    connect_timeout: float = 10
+    timeout: Optional[float] = None
+    prewarm: bool = True
+    breaker_threshold: int = 5
+    breaker_delay: float = 60
+    breaker_max_delay: float = 3600
+    phash_threshold: Optional[int] = None
+    phash_algorithm: str = 'dhash'
+    overlap: str = 'skip'
+    deadline: Optional[float] = None
+    backend: str = 'moviepy'
+    incremental: bool = False
+    encode: Optional[EncodeProfile] = None
+    frame_budget: Optional[int] = None
+    target_duration: Optional[float] = None
 
 
 @dataclass_json
@@ -68,8 +122,29 @@ class Conf:
     tele_proxy: Optional[str] = None
     root_dir: Optional[str] = None
     google_photos: Optional[GooglePhotos] = None
+    capture_start: int = 5
+    capture_end: int = 22
+    cpu_workers: Optional[int] = None
+    io_workers: Optional[int] = None
+    cam_jobs: int = 2
+    metrics_port: Optional[int] = 8080
+    http_limit: int = 100
+    http_limit_per_host: int = 2
+    http_keepalive: float = 30
+    http_dns_ttl: Optional[int] = 300
+    render_workers: Optional[int] = None
+    render_job_memory: int = 512
+    backfill_days: int = 3
+    render_cache_size: int = 32
+    render_cache_ttl: int = 6 * 3600
+    render_max_rss: int = 1024
+    render_timeout: int = 3600
+    font_file: str = '/usr/local/share/fonts/Ubuntu/Ubuntu-Bold.ttf'
 
     def __post_init__(self):
         self.cameras_list = list(self.cameras.values())
         for name, cam in self.cameras.items():
             cam.name = name
+            check_choice(name, 'phash_algorithm', cam.phash_algorithm, HASHES)
+            check_choice(name, 'overlap', cam.overlap, OVERLAP_POLICIES)
+            check_choice(name, 'backend', cam.backend, BACKENDS)
@@ -0,0 +1,88 @@
+from typing import List, Optional, Tuple
+
+from shot import conf
+from shot.conf.model import Cam, EncodeProfile
+
+DEFAULT_PROFILE = EncodeProfile()
+# part of target size left for mp4 container and rate control error
+CONTAINER_OVERHEAD = 0.02
+ONE_PASS_MARGIN = 0.1
+TWO_PASS_MARGIN = 0.03
+MIN_BITRATE = 100
+
+
+def get_profile(cam: Cam) -> EncodeProfile:
+    return cam.encode or DEFAULT_PROFILE
+
+
+def even(value: int) -> int:
+    return value - value % 2
+
+
+def fit_size(profile: EncodeProfile, width: int, height: int) -> Tuple[int, int]:
+    """ Output size inside `max_width`x`max_height` keeping aspect, both sides even
+    """
+    scale = 1.0
+    if profile.max_width and width > profile.max_width:
+        scale = min(scale, profile.max_width / width)
+    if profile.max_height and height > profile.max_height:
+        scale = min(scale, profile.max_height / height)
+    return even(round(width * scale)), even(round(height * scale))
+
+
+def target_bitrate(profile: EncodeProfile, frames: int, fps: float) -> Optional[int]:
+    """ Video bitrate in kbit/s for `frames` at `fps` to fit `target_size`
+    """
+    if not profile.target_size or not frames:
+        return None
+    duration = frames / fps
+    margin = TWO_PASS_MARGIN if profile.two_pass else ONE_PASS_MARGIN
+    bits = profile.target_size * 2 ** 20 * 8 * (1 - CONTAINER_OVERHEAD - margin)
+    return max(int(bits / duration / 1000), MIN_BITRATE)
+
+
+def day_frames(cam: Cam) -> int:
+    """ Frames expected in regular clip, segments are encoded before the day is over
+
+    Capture hours are inclusive, the hour of `capture_end` is captured too.
+    """
+    return max((conf.capture_end - conf.capture_start + 1) * 3600 // cam.interval, 1)
+
+
+def rate_args(profile: EncodeProfile, bitrate: Optional[int]) -> List[str]:
+    if bitrate:
+        return ['-b:v', f'{bitrate}k']
+    if profile.bitrate:
+        return ['-b:v', profile.bitrate]
+    if profile.crf is not None:
+        return ['-crf', str(profile.crf)]
+    return []
+
+
+def codec_args(profile: EncodeProfile, bitrate: Optional[int] = None) -> List[str]:
+    """ ffmpeg output options of profile, `bitrate` of size-targeted mode overrides quality
+    """
+    args = ['-c:v', profile.codec, '-preset', profile.preset]
+    if profile.tune:
+        args += ['-tune', profile.tune]
+    args += rate_args(profile, bitrate)
+    args += ['-pix_fmt', 'yuv420p']
+    if profile.faststart:
+        args += ['-movflags', '+faststart']
+    return args
+
+
+def passes(profile: EncodeProfile, bitrate: Optional[int]) -> List[Optional[int]]:
+    # two-pass makes sense only when bitrate is given
+    if profile.two_pass and (bitrate or profile.bitrate):
+        return [1, 2]
+    return [None]
+
+
+def fingerprint(profile: EncodeProfile) -> str:
+    """ Settings which change encoded stream, segments made with other settings are re-encoded
+    """
+    return ':'.join(str(item) for item in (
+        profile.codec, profile.crf, profile.bitrate, profile.preset, profile.tune,
+        profile.max_width, profile.max_height, profile.target_size,
+    ))
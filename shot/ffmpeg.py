@@ -0,0 +1,132 @@
+import os
+import subprocess as sp
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+from loguru import logger
+
+from shot import conf
+from shot.conf.model import EncodeProfile
+from shot.encode import DEFAULT_PROFILE, codec_args, fit_size, passes, target_bitrate
+from shot.jpeg import sniff
+from shot.overlay import frame_label
+
+FONT_SIZE = 20
+FONT_COLOR = 'red'
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def _quote(path) -> str:
+    return "'" + str(path).replace("'", "'\\''") + "'"
+
+
+def _filter_path(path) -> str:
+    # paths inside filtergraph are escaped twice: for option value and for graph
+    return str(path).replace('\\', '\\\\\\\\').replace(':', '\\\\:').replace("'", "\\\\\\'")
+
+
+def write_manifest(sequence: Sequence[str], fps: int, path: Path):
+    """ concat demuxer list, every image lasts one frame
+    """
+    with open(path, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+        for item in sequence:
+            f.write(f'file {_quote(item)}\nduration {1 / fps:.6f}\n')
+
+
+def write_timestamps(sequence: Sequence[str], fps: int, path: Path):
+    """ sendcmd script which switches drawtext label on every frame
+    """
+    with open(path, 'w') as f:
+        for i, item in enumerate(sequence):
+            f.write(f"{i / fps:.6f} drawtext reinit 'text={frame_label(item)}';\n")
+
+
+def run(cmd: List[str]):
+    logger.info(f'Running command {" ".join(cmd)}')
+    proc = sp.run(cmd, stdin=sp.DEVNULL, stdout=sp.DEVNULL, stderr=sp.PIPE)
+    if proc.returncode:
+        raise FFmpegError(proc.stderr.decode('utf8', 'replace')[-2000:])
+
+
+def render_sequence(sequence: Sequence[str], fps: int, movie_path: Path, work_dir: Path, timestamps: bool = True,
+                    profile: EncodeProfile = DEFAULT_PROFILE, frames: Optional[int] = None):
+    """ Decodes, labels and encodes frames in single ffmpeg process
+
+    Frames are listed in concat manifest, timestamps are burned in by drawtext driven
+    by sendcmd script. Output size follows the first frame fitted into profile limits,
+    size-targeted bitrate is computed for `frames` (whole sequence by default).
+    Returns (width, height).
+    """
+    width, height = fit_size(profile, *sniff(sequence[0]).size)
+    bitrate = target_bitrate(profile, frames or len(sequence), fps)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    stem = f'{movie_path.stem}.{os.getpid()}'
+    manifest = work_dir / f'{stem}.ffconcat'
+    commands = work_dir / f'{stem}.cmd'
+    passlog = work_dir / f'{stem}.passlog'
+    tmp = work_dir / f'{stem}.part.mp4'
+    write_manifest(sequence, fps, manifest)
+    filters = [f'setpts=N/{fps}/TB', f'scale={width}:{height}', 'setsar=1']
+    if timestamps:
+        write_timestamps(sequence, fps, commands)
+        filters.append(f"sendcmd=f={_filter_path(commands)}")
+        filters.append(
+            f"drawtext=fontfile={_filter_path(conf.font_file)}:text={frame_label(sequence[0])}:"
+            f"fontsize={FONT_SIZE}:fontcolor={FONT_COLOR}:x=w-tw:y=0"
+        )
+    cmd = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', str(manifest),
+        '-vf', ','.join(filters),
+        '-r', str(fps),
+    ] + codec_args(profile, bitrate) + ['-an']
+    try:
+        for number in passes(profile, bitrate):
+            if number is None:
+                run(cmd + [str(tmp)])
+            elif number == 1:
+                run(cmd + ['-pass', '1', '-passlogfile', str(passlog), '-f', 'null', os.devnull])
+            else:
+                run(cmd + ['-pass', '2', '-passlogfile', str(passlog), str(tmp)])
+        movie_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, movie_path)
+    finally:
+        for item in (manifest, commands, tmp, *work_dir.glob(f'{passlog.name}*')):
+            if item.exists():
+                item.unlink()
+    return width, height
+
+
+def concat_segments(segments: Sequence[Path], movie_path: Path, work_dir: Path, speed: float = 1):
+    """ Joins encoded segments with concat demuxer without re-encoding
+
+    `speed` rescales timestamps of the stream, so segments can be played faster as is.
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+    stem = f'{movie_path.stem}.{os.getpid()}'
+    manifest = work_dir / f'{stem}.ffconcat'
+    tmp = work_dir / f'{stem}.part.mp4'
+    with open(manifest, 'w') as f:
+        f.write('ffconcat version 1.0\n')
+        for item in segments:
+            f.write(f'file {_quote(item)}\n')
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error']
+    if speed != 1:
+        cmd += ['-itsscale', f'{1 / speed:.6f}']
+    cmd += ['-f', 'concat', '-safe', '0', '-i', str(manifest), '-c', 'copy', '-movflags', '+faststart', '-an', str(tmp)]
+    try:
+        run(cmd)
+        movie_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, movie_path)
+    finally:
+        for item in (manifest, tmp):
+            if item.exists():
+                item.unlink()
+
+
+def extract_frame(video: Path, path: Path):
+    run(['ffmpeg', '-y', '-loglevel', 'error', '-i', str(video), '-frames:v', '1', '-q:v', '2', str(path)])
@@ -0,0 +1,159 @@
+import asyncio
+import collections
+from typing import Dict, Optional
+
+from loguru import logger
+
+from shot.conf.model import Cam
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+CHUNK_SIZE = 64 * 1024
+RESTART_DELAY = 30
+# grabber without new frame for this many freshness periods is considered stalled
+STALL_FACTOR = 2
+
+
+class HLSGrabber:
+    """ Long-lived ffmpeg process which decodes HLS stream and emits MJPEG frames on stdout
+
+    Only the newest frame is kept, so capture tick just takes it without spawning ffmpeg
+    and downloading playlist with whole segment again.
+    """
+
+    def __init__(self, cam: Cam):
+        self.cam = cam
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self.latest: Optional[bytes] = None
+        self.latest_at: float = 0
+        self.started_at: float = float('-inf')
+        self.restarts: int = 0
+        self._reader: Optional[asyncio.Task] = None
+        self._stderr = collections.deque(maxlen=20)
+
+    @property
+    def cmd(self):
+        return [
+            'ffmpeg',
+            '-loglevel',
+            'error',
+            '-i',
+            self.cam.url,
+            '-vf',
+            f'fps={self.cam.hls_fps}',
+            '-f',
+            'image2pipe',
+            '-c:v',
+            'mjpeg',
+            '-q:v',
+            '2',
+            '-',
+        ]
+
+    @property
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
+
+    async def start(self):
+        logger.info(f'Starting HLS grabber for {self.cam.name}')
+        self.started_at = asyncio.get_event_loop().time()
+        self.latest = None
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._reader = asyncio.ensure_future(self._read(self.proc))
+
+    async def stop(self):
+        if self.alive:
+            logger.info(f'Stopping HLS grabber for {self.cam.name}')
+            self.proc.terminate()
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+        if self._reader:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        self.proc = None
+        self._reader = None
+
+    async def frame(self) -> Optional[bytes]:
+        """ Returns newest frame or None if grabber is (re)starting and has nothing fresh yet
+        """
+        now = asyncio.get_event_loop().time()
+        if not self.alive:
+            if self.proc is not None:
+                logger.warning(f'HLS grabber for {self.cam.name} died: {" ".join(self._stderr)}')
+                self.restarts += 1
+                await self.stop()
+            if now - self.started_at < RESTART_DELAY:
+                return
+            await self.start()
+            return
+        fresh = max(self.cam.interval, 10)
+        if now - max(self.latest_at, self.started_at) > fresh * STALL_FACTOR:
+            # process is alive but stream is stuck, e.g. playlist is not updated anymore
+            logger.warning(f'HLS grabber for {self.cam.name} stalled: {" ".join(self._stderr)}')
+            self.restarts += 1
+            await self.stop()
+            await self.start()
+            return
+        if self.latest is None or now - self.latest_at > fresh:
+            return
+        return self.latest
+
+    async def _read(self, proc: asyncio.subprocess.Process):
+        stderr = asyncio.ensure_future(self._drain_stderr(proc))
+        buffer = b''
+        try:
+            while True:
+                chunk = await proc.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                buffer += chunk
+                while True:
+                    start = buffer.find(SOI)
+                    if start < 0:
+                        buffer = buffer[-1:]
+                        break
+                    end = buffer.find(EOI, start + 2)
+                    if end < 0:
+                        buffer = buffer[start:]
+                        break
+                    self.latest = buffer[start:end + 2]
+                    self.latest_at = asyncio.get_event_loop().time()
+                    buffer = buffer[end + 2:]
+        finally:
+            stderr.cancel()
+
+    async def _drain_stderr(self, proc: asyncio.subprocess.Process):
+        while True:
+            line = await proc.stderr.readline()
+            if not line:
+                break
+            self._stderr.append(line.decode('utf8', errors='replace').strip())
+
+
+grabbers: Dict[str, HLSGrabber] = {}
+
+
+def get_grabber(cam: Cam) -> HLSGrabber:
+    if cam.name not in grabbers:
+        grabbers[cam.name] = HLSGrabber(cam)
+    return grabbers[cam.name]
+
+
+async def stop_grabber(cam: Cam):
+    """ Stops grabber of camera if any, next `frame` call starts it again
+    """
+    grabber = grabbers.get(cam.name)
+    if grabber is not None:
+        await grabber.stop()
+
+
+async def stop_grabbers():
+    await asyncio.gather(*(grabber.stop() for grabber in grabbers.values()), return_exceptions=True)
+    grabbers.clear()
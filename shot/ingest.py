@@ -0,0 +1,100 @@
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+from loguru import logger
+
+from shot.jpeg import JpegError, sniff
+from shot.phash import HASHES, hamming
+
+GRAY_MODES = ('1', 'L', 'I', 'F')
+
+
+class GrayCheckError(Exception):
+    pass
+
+
+@dataclass
+class IngestResult:
+    phash: Optional[int] = None
+    similar: bool = False
+    stored: bool = True
+    gray: bool = False
+
+
+def ingest_img(tmp: Path, path: Path, original: Optional[Path], size, previous_phash, threshold,
+               algorithm: str = 'dhash'):
+    """ Stores downloaded frame decoding it only once
+
+    Gray check, perceptual hash and resize share one decoded image. With `size` JPEG is
+    decoded in draft mode, so downscaling happens in DCT domain. Original is moved
+    into place without re-encoding. Frames in other formats are fully decoded and
+    stored as JPEG, the rest of the pipeline reads JPEG only.
+    """
+    logger.debug(f'Ingest image {path}')
+    if not size and threshold is None:
+        # nothing to decode for, markers are enough to check JPEG
+        try:
+            info = sniff(tmp)
+        except JpegError as exc:
+            logger.debug(f'Decoding {tmp} in full: {exc}')
+            info = None
+        except Exception:
+            logger.exception(f'Can not read file {tmp}')
+            tmp.unlink()
+            raise GrayCheckError
+        if info is not None and not info.complete:
+            logger.warning(f'Truncated file {tmp}')
+            tmp.unlink()
+            raise GrayCheckError
+        if info is not None and not info.gray:
+            os.replace(tmp, path)
+            return IngestResult()
+    try:
+        image = Image.open(tmp)
+        gray = image.mode in GRAY_MODES
+        jpeg = image.format == 'JPEG'
+        if size:
+            image.draft(image.mode, size)
+        elif not gray:
+            # only validate stream and feed perceptual hash, file itself is stored as is
+            image.draft(image.mode, (64, 64))
+        image.load()
+    except Exception:
+        logger.exception(f'Can not read file {tmp}')
+        tmp.unlink()
+        raise GrayCheckError
+    result = IngestResult(gray=gray)
+    if threshold is not None:
+        try:
+            result.phash = HASHES[algorithm](image)
+        except Exception:
+            tmp.unlink()
+            raise
+        if previous_phash is not None:
+            result.similar = hamming(previous_phash, result.phash) <= threshold
+    if result.similar:
+        tmp.unlink()
+        result.stored = False
+        return result
+    if size:
+        if jpeg:
+            os.replace(tmp, original)
+        else:
+            image = image.convert('RGB')
+            image.save(original, format='JPEG')
+            tmp.unlink()
+        image.thumbnail(size, Image.ANTIALIAS)
+        if gray:
+            logger.info(f'Converting {path} to RGB')
+            image = image.convert('RGB')
+        image.save(path, format='JPEG')
+    elif gray or not jpeg:
+        logger.info(f'Converting {path} to RGB JPEG')
+        image.convert('RGB').save(path, format='JPEG')
+        tmp.unlink()
+    else:
+        os.replace(tmp, path)
+    return result
@@ -0,0 +1,296 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from shot import conf, metrics
+from shot.cache import ResultCache
+from shot.conf.model import Cam
+from shot.journal import get_state
+from shot.model import RenderTask, db
+from shot.model.helpers import ThreadSwitcherWithDB, db_in_thread
+from shot.render import renderer
+from shot.shooter import make_movie, make_segments, make_timelapse, make_weekly_movie
+from shot.timelapse import DAY_FORMAT
+
+# lower is served first
+INTERACTIVE = 0
+SCHEDULED = 10
+BACKFILL = 20
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def render_daily(cam: Cam, day: str, preset: Optional[str]):
+    return make_movie(cam, day)
+
+
+def render_today(cam: Cam, day: str, preset: Optional[str]):
+    return make_movie(cam, day, regular=False)
+
+
+def render_weekly(cam: Cam, day: str, preset: Optional[str]):
+    return make_weekly_movie(cam)
+
+
+def render_timelapse(cam: Cam, day: str, preset: Optional[str]):
+    return make_timelapse(cam, preset)
+
+
+def render_segments(cam: Cam, day: str, preset: Optional[str]):
+    return make_segments(cam, day)
+
+
+def day_version(cam: Cam, day: str) -> Optional[Hashable]:
+    """ Changes whenever frames of the day change, None when there are no frames
+
+    Long range movies end at `day` too, only the last day of them still gets frames.
+    """
+    state = get_state(cam)
+    if state.day == day:
+        return state.frames, state.last_capture
+    try:
+        return (Path(conf.root_dir) / 'data' / cam.name / 'regular' / 'imgs' / day).stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+RENDERS = {
+    'daily': render_daily,
+    'today': render_today,
+    'weekly': render_weekly,
+    'timelapse': render_timelapse,
+    'segments': render_segments,
+}
+
+
+@dataclass(order=True)
+class QueuedJob:
+    priority: int
+    seq: int
+    kind: str = field(compare=False)
+    cam: Cam = field(compare=False)
+    day: str = field(compare=False)
+    preset: Optional[str] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    task_id: Optional[int] = field(default=None, compare=False)
+
+    @property
+    def key(self) -> Tuple[str, str, str, Optional[str]]:
+        return self.cam.name, self.kind, self.day, self.preset
+
+
+class RenderQueue:
+    """ Prioritized render queue, every job is recorded in `render_tasks` table
+
+    Interactive requests are served ahead of scheduled and backfill ones. Jobs of different
+    cameras run in parallel up to `limit`, which matches size of render pool, one job per
+    camera at a time. Jobs wait for render workers in own threads, not in shared io pool
+    which capture depends on. Same request submitted twice waits for the job already queued,
+    finished movies are served from cache until frames they are made of change.
+    """
+
+    def __init__(self):
+        self.pending: List[QueuedJob] = []
+        self.active: Dict[Tuple[str, str, str, Optional[str]], QueuedJob] = {}
+        self.busy: Set[str] = set()
+        self.running = 0
+        self.limit = 1
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.cache = ResultCache(conf.render_cache_size, conf.render_cache_ttl)
+
+    async def start(self):
+        # sized by render pool, so queue never dispatches more jobs than there are workers
+        renderer.start()
+        self.limit = renderer.size
+        self._executor = ThreadPoolExecutor(max_workers=self.limit, thread_name_prefix='render')
+        self._wakeup = asyncio.Event()
+        await self.recover()
+        self._dispatcher = asyncio.ensure_future(self._dispatch())
+        logger.info(f'Render queue started, {self.limit} jobs at once')
+
+    async def stop(self):
+        for task in [self._dispatcher, *self._tasks]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._dispatcher = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(self, kind: str, cam: Cam, day: Optional[str] = None, preset: Optional[str] = None,
+                     priority: int = INTERACTIVE, chat_id: Optional[int] = None):
+        """ Queues render and waits for its `Movie`
+        """
+        day = day or datetime.date.today().strftime(DAY_FORMAT)
+        key = cam.name, kind, day, preset
+        cached = self.cache.get(key, day_version(cam, day))
+        if cached is not None and cached.path.exists():
+            logger.info(f'Render {kind} {cam.name}:{day} is up to date, using cached movie')
+            metrics.render_requests.inc(kind=kind, result='hit')
+            return cached
+        job = self.active.get(key)
+        if job is None:
+            metrics.render_requests.inc(kind=kind, result='miss')
+            job = QueuedJob(priority, next(self._seq), kind, cam, day, preset, asyncio.get_event_loop().create_future())
+            # failed job nobody waits for anymore should not be reported as unretrieved
+            job.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self.active[key] = job
+            job.task_id = await self.record(job, chat_id)
+            heapq.heappush(self.pending, job)
+            self._wakeup.set()
+        else:
+            logger.info(f'Render {kind} {cam.name}:{day} is already queued, waiting for it')
+            metrics.render_requests.inc(kind=kind, result='coalesced')
+        return await asyncio.shield(job.future)
+
+    def _next(self) -> Optional[QueuedJob]:
+        skipped, job = [], None
+        while self.pending:
+            candidate = heapq.heappop(self.pending)
+            if candidate.cam.name in self.busy:
+                skipped.append(candidate)
+                continue
+            job = candidate
+            break
+        for item in skipped:
+            heapq.heappush(self.pending, item)
+        return job
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self.running < self.limit:
+                job = self._next()
+                if job is None:
+                    break
+                self.running += 1
+                self.busy.add(job.cam.name)
+                task = asyncio.ensure_future(self._run(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: QueuedJob):
+        logger.info(f'Render {job.kind} {job.cam.name}:{job.day} started')
+        await self.update(job.task_id, status=RUNNING, started=datetime.datetime.utcnow(), attempts=1)
+        # taken before render, frames which come during it make the result stale
+        version = day_version(job.cam, job.day)
+        try:
+            render = partial(RENDERS[job.kind], job.cam, job.day, job.preset)
+            result = await asyncio.get_event_loop().run_in_executor(self._executor, render)
+        except Exception as exc:
+            await self.update(job.task_id, status=FAILED, finished=datetime.datetime.utcnow(),
+                              error=f'{exc.__class__.__name__}: {exc}')
+            if not job.future.done():
+                job.future.set_exception(exc)
+        else:
+            await self.update(job.task_id, status=DONE, finished=datetime.datetime.utcnow())
+            if result is not None:
+                self.cache.put(job.key, version, result)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.running -= 1
+            self.busy.discard(job.cam.name)
+            self.active.pop(job.key, None)
+            self._wakeup.set()
+
+    @ThreadSwitcherWithDB.optimized
+    async def record(self, job: QueuedJob, chat_id: Optional[int]) -> Optional[int]:
+        try:
+            async with db_in_thread():
+                task = RenderTask(
+                    cam=job.cam.name, kind=job.kind, day=job.day, preset=job.preset, priority=job.priority,
+                    status=QUEUED, attempts=0, chat_id=chat_id,
+                )
+                db.add(task)
+                db.commit()
+                return task.task_id
+        except Exception:
+            # queue keeps working without database, only history is lost
+            logger.exception(f'Can not record render {job.kind} {job.cam.name}:{job.day}')
+
+    @ThreadSwitcherWithDB.optimized
+    async def update(self, task_id: Optional[int], attempts: int = 0, **values):
+        if task_id is None:
+            return
+        try:
+            async with db_in_thread():
+                task = db.query(RenderTask).get(task_id)
+                for name, value in values.items():
+                    setattr(task, name, value)
+                task.attempts += attempts
+                db.commit()
+        except Exception:
+            logger.exception(f'Can not update render task {task_id}')
+
+    @ThreadSwitcherWithDB.optimized
+    async def recover(self):
+        """ Jobs left by previous run are closed, daily ones are picked up by backfill
+        """
+        try:
+            async with db_in_thread():
+                stale = db.query(RenderTask).filter(RenderTask.status.in_([QUEUED, RUNNING])).all()
+                for task in stale:
+                    task.status = FAILED
+                    task.error = 'interrupted by restart'
+                    task.finished = datetime.datetime.utcnow()
+                db.commit()
+                count = len(stale)
+        except Exception:
+            logger.exception('Can not recover render tasks')
+            return
+        if count:
+            logger.warning(f'{count} render tasks were interrupted by restart')
+
+    @ThreadSwitcherWithDB.optimized
+    async def missed_days(self, cam: Cam) -> List[str]:
+        """ Recent days which have frames but no finished daily movie
+        """
+        today = datetime.date.today()
+        root = Path(conf.root_dir) / 'data' / cam.name / 'regular'
+        days = []
+        for offset in range(conf.backfill_days, 0, -1):
+            day = (today - datetime.timedelta(days=offset)).strftime(DAY_FORMAT)
+            folder = root / 'imgs' / day
+            if (root / 'clips' / f'{day}.mp4').exists():
+                continue
+            if folder.is_dir() and any(folder.iterdir()):
+                days.append(day)
+        if not days:
+            return []
+        async with db_in_thread():
+            done = db.query(RenderTask.day).filter(
+                RenderTask.cam == cam.name, RenderTask.kind == 'daily', RenderTask.status == DONE,
+                RenderTask.day.in_(days),
+            ).all()
+        done = {day for day, in done}
+        return [day for day in days if day not in done]
+
+    def stats(self):
+        return {'running': self.running, 'limit': self.limit, 'pending': len(self.pending), 'cached': len(self.cache)}
+
+
+render_queue = RenderQueue()
+
+
+@metrics.register_collector
+def collect_render_queue():
+    metrics.render_queue_running.set(render_queue.running)
+    metrics.render_queue_pending.set(len(render_queue.pending))
@@ -0,0 +1,76 @@
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from dataclasses_json import dataclass_json
+from loguru import logger
+
+from shot import conf
+from shot.conf.model import Cam
+
+
+@dataclass_json
+@dataclass
+class CamState:
+    """ Capture state of camera which survives restarts
+
+    Frame counters are for `day` only and are reset on the first capture of the next day,
+    conditional request counters are kept since the journal was created.
+    """
+    day: Optional[str] = None
+    last_hash: Optional[str] = None
+    last_phash: Optional[int] = None
+    last_capture: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    frames: int = 0
+    bytes: int = 0
+    original_frames: int = 0
+    original_bytes: int = 0
+    not_modified: int = 0
+    validators_ignored: int = 0
+
+    def rollover(self, day: str, frames: int = 0, size: int = 0, original_frames: int = 0, original_size: int = 0):
+        self.day = day
+        self.frames = frames
+        self.bytes = size
+        self.original_frames = original_frames
+        self.original_bytes = original_size
+
+
+def state_path(cam: Cam) -> Path:
+    return Path(conf.root_dir) / 'data' / cam.name / 'state.json'
+
+
+def load_state(cam: Cam) -> CamState:
+    path = state_path(cam)
+    if not path.exists():
+        return CamState()
+    try:
+        with open(path, 'r') as f:
+            return CamState.from_dict(json.load(f))
+    except Exception:
+        logger.exception(f'Can not load state journal {path}')
+        return CamState()
+
+
+states: Dict[str, CamState] = {}
+
+
+def get_state(cam: Cam) -> CamState:
+    """ Shared state of camera, loaded from journal on first access
+    """
+    if cam.name not in states:
+        states[cam.name] = load_state(cam)
+    return states[cam.name]
+
+
+def save_state(cam: Cam):
+    path = state_path(cam)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        f.write(get_state(cam).to_json())
+    os.replace(tmp, path)
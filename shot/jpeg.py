@@ -0,0 +1,76 @@
+import os
+import struct
+from dataclasses import dataclass
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+SOS = 0xda
+# SOF0-SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+SOF_MARKERS = {0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7, 0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf}
+# markers without length field
+STANDALONE_MARKERS = {0x01, 0xd0, 0xd1, 0xd2, 0xd3, 0xd4, 0xd5, 0xd6, 0xd7}
+TAIL_SIZE = 1024
+
+
+class JpegError(Exception):
+    pass
+
+
+@dataclass
+class JpegInfo:
+    width: int
+    height: int
+    components: int
+    complete: bool
+
+    @property
+    def gray(self):
+        return self.components == 1
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def sniff(path) -> JpegInfo:
+    """ Reads JPEG facts from markers only, pixels are never decoded
+
+    Dimensions and components come from SOF segment, `complete` tells whether file ends
+    with EOI marker (some cameras pad file with zeros after it).
+    """
+    with open(path, 'rb') as f:
+        if f.read(2) != SOI:
+            raise JpegError(f'{path} is not JPEG')
+        while True:
+            byte = f.read(1)
+            if not byte:
+                raise JpegError(f'{path} has no SOF segment')
+            if byte != b'\xff':
+                continue
+            marker = f.read(1)
+            while marker == b'\xff':
+                marker = f.read(1)
+            if not marker:
+                raise JpegError(f'{path} has no SOF segment')
+            marker = marker[0]
+            if marker in STANDALONE_MARKERS:
+                continue
+            if marker == SOS:
+                raise JpegError(f'{path} has no SOF segment before scan')
+            length = f.read(2)
+            if len(length) < 2:
+                raise JpegError(f'{path} is truncated in headers')
+            length = struct.unpack('>H', length)[0]
+            if marker in SOF_MARKERS:
+                segment = f.read(6)
+                if len(segment) < 6:
+                    raise JpegError(f'{path} is truncated in SOF segment')
+                _, height, width, components = struct.unpack('>BHHB', segment)
+                break
+            f.seek(length - 2, os.SEEK_CUR)
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(max(end - TAIL_SIZE, 0))
+        tail = f.read()
+    complete = tail.rstrip(b'\x00').endswith(EOI)
+    return JpegInfo(width, height, components, complete)
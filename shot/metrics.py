@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+from loguru import logger
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+def _escape(value: str) -> str:
+    # exposition format allows only these escapes inside label value
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    if extra:
+        labels = labels + (extra,)
+    if not labels:
+        return ''
+    inner = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+    return '{' + inner + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """ Minimal Prometheus metric, samples are keyed by sorted label pairs
+    """
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._values: Dict[Tuple[Tuple[str, str], ...], float] = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    @staticmethod
+    def _key(labels) -> Tuple[Tuple[str, str], ...]:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in self._values.items()]
+
+    def expose(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._counts: Dict[Tuple[Tuple[str, str], ...], List[int]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = self._values.get(key, 0) + value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, counts in self._counts.items():
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(key, ("le", _format_value(bound)))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(self._values[key])}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {counts[-1]}')
+        return lines
+
+
+registry: List[Metric] = []
+collectors: List[Callable[[], None]] = []
+
+
+def register_collector(func: Callable[[], None]):
+    """ Collector is called on every scrape to refresh gauges from current state
+    """
+    collectors.append(func)
+    return func
+
+
+def expose() -> str:
+    for collector in collectors:
+        try:
+            collector()
+        except Exception:
+            logger.exception(f'Error in metrics collector {collector.__name__}')
+    return '\n'.join(metric.expose() for metric in registry) + '\n'
+
+
+async def metrics_handler(request):
+    return web.Response(text=expose(), content_type='text/plain', charset='utf-8')
+
+
+async def start_server(port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '0.0.0.0', port)
+    await site.start()
+    logger.info(f'Metrics server is listening on {port}')
+    return runner
+
+
+# capture
+capture_seconds = Histogram('getcam_capture_seconds', 'Time of capture from request to stored frame')
+capture_total = Counter('getcam_capture_total', 'Captures by result')
+capture_bytes = Counter('getcam_capture_bytes_total', 'Bytes of stored frames')
+capture_validators_ignored = Counter('getcam_capture_validators_ignored_total', 'Full responses to conditional requests')
+capture_last_success = Gauge('getcam_capture_last_success_age_seconds', 'Seconds since last stored frame')
+capture_missed_ticks = Counter('getcam_capture_missed_ticks_total', 'Scheduler ticks missed')
+camera_circuit_state = Gauge('getcam_camera_circuit_state', 'Camera circuit state: 0 closed, 1 half-open, 2 open')
+camera_failures = Gauge('getcam_camera_consecutive_failures', 'Consecutive failed captures of camera')
+http_seconds = Histogram('getcam_http_seconds', 'Camera request latency by phase: dns, connect, headers, read')
+http_connections = Counter('getcam_http_connections_total', 'Camera connections by kind: new or reused from pool')
+# render
+render_seconds = Histogram('getcam_render_seconds', 'Time of movie render')
+render_frames = Counter('getcam_render_frames_total', 'Frames rendered into movies')
+render_output_bytes = Gauge('getcam_render_output_bytes', 'Size of last rendered movie')
+render_fps = Gauge('getcam_render_encode_fps', 'Encode speed of last rendered movie, frames per second')
+render_failed = Counter('getcam_render_failed_total', 'Failed renders')
+render_queue_running = Gauge('getcam_render_queue_running', 'Render jobs in progress')
+render_queue_pending = Gauge('getcam_render_queue_pending', 'Render jobs waiting in queue')
+render_requests = Counter('getcam_render_requests_total', 'Render requests by result: hit, coalesced or miss')
+# delivery
+telegram_seconds = Histogram('getcam_telegram_api_seconds', 'Latency of Telegram API calls')
+telegram_retries = Counter('getcam_telegram_api_retries_total', 'Retried Telegram API calls')
+upload_bytes = Counter('getcam_upload_bytes_total', 'Bytes of uploaded videos')
+upload_speed = Gauge('getcam_upload_bytes_per_second', 'Throughput of last video upload')
+upload_cached = Counter('getcam_upload_cached_total', 'Videos sent by file id of previous upload')
+# runtime
+executor_pending = Gauge('getcam_executor_pending', 'Jobs submitted to pool and not finished yet')
+executor_queue_depth = Gauge('getcam_executor_queue_depth', 'Jobs waiting for free worker')
+executor_wait_seconds = Gauge('getcam_executor_wait_seconds', 'Average time spent in pool queue')
+disk_free = Gauge('getcam_disk_free_bytes', 'Free disk space')
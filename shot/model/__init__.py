@@ -1,6 +1,8 @@
+import datetime
+
 from loguru import logger
 from sqla_wrapper import SQLAlchemy
-from sqlalchemy import BigInteger, Column, Integer, String
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, String, Text
 from sqlalchemy.exc import SQLAlchemyError
 
 from shot import conf
@@ -46,5 +48,28 @@ class PhotoChannel(BaseModel):
                 data[cam.name] = item.chat_id
         return data
 
+
+class RenderTask(BaseModel):
+    """ Render job of the queue, kept so restarts and missed days can be found
+    """
+    task_id = Column(Integer, primary_key=True)
+    cam = Column(String(length=64), nullable=False)
+    kind = Column(String(length=16), nullable=False)
+    day = Column(String(length=16))
+    preset = Column(String(length=16))
+    priority = Column(Integer, nullable=False, default=0)
+    status = Column(String(length=16), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text)
+    chat_id = Column(BigInteger)
+    created = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    started = Column(DateTime)
+    finished = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_render_tasks_cam_kind_day', 'cam', 'kind', 'day'),
+        Index('ix_render_tasks_status', 'status'),
+    )
+
 # db.create_all()
 # TODO automate db.create_all()
@@ -1,18 +1,30 @@
 import argparse
+import dataclasses
+import datetime
 import logging
+import os
 import sys
-from concurrent import futures
 from pathlib import Path
+from typing import Optional
 
-import imageio
 from PIL import Image
 from loguru import logger
-from moviepy.video.VideoClip import TextClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
 
 from shot import conf
-from shot.conf.model import Cam
+from shot.activity import frame_budget, select_active
+from shot.conf.model import Cam, EncodeProfile
+from shot.encode import day_frames, fit_size, get_profile, passes, rate_args, target_bitrate
+from shot.ffmpeg import concat_segments, render_sequence
+from shot.jpeg import sniff
+from shot.overlay import get_atlas, timestamp_clip
+from shot.segments import (
+    Segment, group_by_hour, is_closed, is_valid, load_index, save_index, segment_key, segment_path,
+)
+from shot.shooter import Movie, seq_middle
+from shot.sidecar import thumb_path, write_sidecar
+from shot.timelapse import DAY_FORMAT, PRESETS, select
 
 
 def init_logging():
@@ -39,11 +51,13 @@ def init_logging():
     logging.getLogger('backoff').setLevel(logging.DEBUG)
 
 
-def ts_clip(path):
-    logger.debug(f'Txt frame with timestamp {path}')
-    label = path.split('/')[-1].split('.')[0].replace('_', '.')
-    txt = TextClip(txt=label, fontsize=20, color="red", font='Ubuntu-Bold', transparent=True)
-    return txt.get_frame(0)
+def warm():
+    """ Rasterizes timestamp glyphs before first job
+    """
+    try:
+        get_atlas()
+    except Exception:
+        logger.exception('Can not load timestamp font')
 
 
 def convert_gray_to_rgb(path):
@@ -56,21 +70,20 @@ def convert_gray_to_rgb(path):
 
 def make_txt_movie(sequence, fps):
     logger.debug('Creating txt movie..')
-    txt_clip = []
-    with futures.ThreadPoolExecutor() as pool:
-        for item in pool.map(ts_clip, sequence):
-            txt_clip.append(item)
-    return ImageSequenceClip(txt_clip, fps=fps)
+    return timestamp_clip(sequence, fps)
 
 
 def image_gray_check(path):
     logger.debug(f'Gray check {path}')
     try:
-        image = imageio.imread(path)
+        info = sniff(path)
     except Exception:
         logger.exception(f'Can not read file {path}')
         return
-    if len(image.shape) < 3:
+    if not info.complete:
+        logger.warning(f'Skip truncated file {path}')
+        return
+    if info.gray:
         convert_gray_to_rgb(path)
     return path
 
@@ -78,30 +91,144 @@ def image_gray_check(path):
 def check_sequence_for_gray_images(sequence):
     logger.debug('Checking sequence for gray images')
     converted = []
-    with futures.ThreadPoolExecutor() as pool:
-        for item in pool.map(image_gray_check, sequence):
-            if item is not None:
-                converted.append(item)
+    for item in map(image_gray_check, sequence):
+        if item is not None:
+            converted.append(item)
     return converted
 
 
+def moviepy_params(profile: EncodeProfile, bitrate, size, clip_size):
+    params = rate_args(profile, bitrate)
+    if profile.tune:
+        params += ['-tune', profile.tune]
+    if profile.faststart:
+        params += ['-movflags', '+faststart']
+    if size != clip_size:
+        params += ['-vf', f'scale={size[0]}:{size[1]}']
+    return params + ['-pix_fmt', 'yuv420p']
+
+
+def render_clip(cam: Cam, sequence, movie_path: Path, work_dir: Path, fps: Optional[int] = None,
+                frames: Optional[int] = None):
+    """ Renders sequence with backend and encode profile of camera, returns (width, height)
+
+    `frames` is length of the whole movie when sequence is only part of it, for size-targeted bitrate.
+    """
+    fps = fps or cam.fps
+    profile = get_profile(cam)
+    if cam.backend == 'ffmpeg':
+        return render_sequence(sequence, fps, movie_path, work_dir, profile=profile, frames=frames)
+    txt_clip = make_txt_movie(sequence, fps)
+    logger.info(f'Composing clip for {movie_path}')
+    image_clip = ImageSequenceClip(sequence, fps=fps)
+    logger.info(f'ImageSequenceClip ready')
+    clip = CompositeVideoClip([image_clip, txt_clip.set_position(('right', 'top'))], use_bgclip=True)
+    logger.info(f'CompositeVideoClip ready')
+    work_dir.mkdir(parents=True, exist_ok=True)
+    stem = f'{movie_path.stem}.{os.getpid()}'
+    tmp = work_dir / f'{stem}.part.mp4'
+    passlog = work_dir / f'{stem}.passlog'
+    size = fit_size(profile, clip.w, clip.h)
+    bitrate = target_bitrate(profile, frames or len(sequence), fps)
+    params = moviepy_params(profile, bitrate, size, (clip.w, clip.h))
+    options = dict(audio=False, codec=profile.codec, preset=profile.preset)
+    try:
+        for number in passes(profile, bitrate):
+            if number is None:
+                clip.write_videofile(str(tmp), ffmpeg_params=params, **options)
+            elif number == 1:
+                first = params + ['-pass', '1', '-passlogfile', str(passlog), '-f', 'null']
+                clip.write_videofile(os.devnull, ffmpeg_params=first, **options)
+            else:
+                second = params + ['-pass', '2', '-passlogfile', str(passlog)]
+                clip.write_videofile(str(tmp), ffmpeg_params=second, **options)
+        movie_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, movie_path)
+    finally:
+        for item in (tmp, *work_dir.glob(f'{passlog.name}*')):
+            if item.exists():
+                item.unlink()
+    return size
+
+
+def finish_movie(cam: Cam, movie_path: Path, size, frames: int, fps: int, cover: Path) -> Movie:
+    """ Writes sidecar with metadata and small thumbnail of rendered movie
+    """
+    width, height = size
+    meta = write_sidecar(movie_path, width, height, frames, fps, get_profile(cam).codec, cover)
+    return Movie(height, width, movie_path, thumb_path(movie_path) if meta.thumb else cover, frames)
+
+
+def make_segments(cam: Cam, day: str, sequence=None, closed_only: bool = True):
+    """ Encodes hours of the day which have no valid segment yet, returns segments in hour order
+
+    Hour which is still in progress is skipped with `closed_only`. Segments whose frames
+    are already removed are kept as they are.
+    """
+    root = Path(conf.root_dir) / 'data' / cam.name
+    if sequence is None:
+        path = root / 'regular' / 'imgs' / day
+        sequence = sorted(str(p) for p in path.iterdir()) if path.exists() else []
+    index = load_index(cam, day)
+    for hour, frames in group_by_hour(sequence).items():
+        if closed_only and not is_closed(day, hour):
+            continue
+        if is_valid(cam, day, hour, index.get(hour), frames):
+            continue
+        checked = check_sequence_for_gray_images(frames)
+        if not checked:
+            continue
+        # budget of the day is shared by hours as they are captured
+        checked = select_active(checked, frame_budget(cam, cam.fps, len(frames) / day_frames(cam)))
+        logger.info(f'Encoding segment {cam.name}:{day}:{hour} of {len(checked)} frames')
+        frames_total = frame_budget(cam, cam.fps) or day_frames(cam)
+        width, height = render_clip(cam, checked, segment_path(cam, day, hour), root / 'tmp', frames=frames_total)
+        index[hour] = Segment(
+            len(frames), Path(frames[-1]).name, width, height, cam.fps, cam.backend, segment_key(cam), len(checked),
+        )
+        save_index(cam, day, index)
+    return [(segment_path(cam, day, hour), index[hour]) for hour in sorted(index)]
+
+
 def make_movie(cam: Cam, day: str, regular: bool = True):
     regular = 'regular' if regular else ''
     root = Path(conf.root_dir) / 'data' / cam.name
     path = root / 'regular' / 'imgs' / day
     logger.info(f'Running make movie for {path}:{day}')
-    # sequence = check_sequence_for_gray_images(sorted(str(p) for p in path.iterdir()))
     sequence = sorted(str(p) for p in path.iterdir())
-    txt_clip = make_txt_movie(sequence, cam.fps)
-    logger.info(f'Composing clip for {path}:{day}')
-    image_clip = ImageSequenceClip(sequence, fps=cam.fps)
-    logger.info(f'ImageSequenceClip ready')
-    clip = CompositeVideoClip([image_clip, txt_clip.set_position(('right', 'top'))], use_bgclip=True)
-    logger.info(f'CompositeVideoClip ready')
     movie_path = root / regular / 'clips' / f'{day}.mp4'
-    movie_path.parent.mkdir(parents=True, exist_ok=True)
-    clip.write_videofile(str(movie_path), audio=False)
-    # return Movie(clip.h, clip.w, movie_path, sequence[seq_middle(sequence)])
+    if cam.incremental:
+        # only hours without valid segment are encoded, the rest is joined without re-encoding
+        segments = make_segments(cam, day, sequence, closed_only=False)
+        sizes = {(segment.width, segment.height) for _, segment in segments}
+        if len(sizes) == 1:
+            concat_segments([p for p, _ in segments], movie_path, root / 'tmp')
+            frames = sum(segment.length for _, segment in segments)
+            return finish_movie(cam, movie_path, sizes.pop(), frames, cam.fps, Path(sequence[seq_middle(sequence)]))
+        logger.warning(f'Segments of {cam.name}:{day} differ in size {sizes}, rendering whole day')
+    sequence = check_sequence_for_gray_images(sequence)
+    sequence = select_active(sequence, frame_budget(cam, cam.fps))
+    size = render_clip(cam, sequence, movie_path, root / 'tmp')
+    return finish_movie(cam, movie_path, size, len(sequence), cam.fps, Path(sequence[seq_middle(sequence)]))
+
+
+def make_timelapse(cam: Cam, preset: str, end: str):
+    """ Long range movie, only frames picked by preset are checked and decoded
+    """
+    spec = PRESETS[preset]
+    end = datetime.datetime.strptime(end, DAY_FORMAT).date()
+    root = Path(conf.root_dir) / 'data' / cam.name
+    if frame_budget(cam, spec.fps):
+        # preset budget is spent by activity instead of even thinning
+        sequence = select(root / 'regular' / 'imgs', dataclasses.replace(spec, budget=None), end)
+        sequence = select_active(check_sequence_for_gray_images(sequence), spec.budget)
+    else:
+        sequence = check_sequence_for_gray_images(select(root / 'regular' / 'imgs', spec, end))
+    if not sequence:
+        raise FileNotFoundError(f'No frames for {spec.name} timelapse of {cam.name}')
+    movie_path = root / 'regular' / spec.name / f'{spec.label(end)}.mp4'
+    size = render_clip(cam, sequence, movie_path, root / 'tmp', fps=spec.fps)
+    return finish_movie(cam, movie_path, size, len(sequence), spec.fps, Path(sequence[seq_middle(sequence)]))
 
 
 def parse_args():
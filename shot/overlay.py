@@ -0,0 +1,98 @@
+import io
+import zipfile
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from moviepy.video.VideoClip import VideoClip
+
+from shot import conf
+
+FONT_ARCHIVE = 'Ubuntu.zip'
+FONT_NAME = 'Ubuntu-Bold.ttf'
+FONT_SIZE = 20
+COLOR = (255, 0, 0)
+CHARSET = '0123456789.-'
+DIGITS = '0123456789'
+
+
+def load_font(size: int = FONT_SIZE) -> ImageFont.FreeTypeFont:
+    """ Installed font is preferred, otherwise it is read from archive in `fonts/`
+    """
+    if Path(conf.font_file).exists():
+        return ImageFont.truetype(conf.font_file, size)
+    with zipfile.ZipFile(Path(conf.root_dir) / 'fonts' / FONT_ARCHIVE) as archive:
+        return ImageFont.truetype(io.BytesIO(archive.read(FONT_NAME)), size)
+
+
+class GlyphAtlas:
+    """ Glyph alpha bitmaps rasterized once, labels are composed by NumPy blitting
+
+    All digits share one cell width, so every label of the same format has the same size
+    and can be used as frame of one clip.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, color=COLOR):
+        self.color = np.array(color, dtype=np.uint8)
+        ascent, descent = font.getmetrics()
+        self.height = ascent + descent
+        masks = {}
+        for char in CHARSET:
+            canvas = Image.new('L', (font.size * 2, self.height))
+            ImageDraw.Draw(canvas).text((0, 0), char, fill=255, font=font)
+            masks[char] = np.asarray(canvas)
+        digit_width = max(self._ink_width(masks[char]) for char in DIGITS)
+        self.glyphs: Dict[str, np.ndarray] = {}
+        for char, mask in masks.items():
+            width = digit_width if char in DIGITS else self._ink_width(mask)
+            self.glyphs[char] = np.ascontiguousarray(mask[:, :width + 1])
+
+    @staticmethod
+    def _ink_width(mask: np.ndarray) -> int:
+        columns = np.nonzero(mask.any(axis=0))[0]
+        return int(columns[-1]) + 1 if len(columns) else mask.shape[1] // 4
+
+    def alpha(self, label: str, width: Optional[int] = None) -> np.ndarray:
+        alpha = np.concatenate([self.glyphs[char] for char in label if char in self.glyphs], axis=1)
+        if width is not None and alpha.shape[1] != width:
+            # label of other format, fit it into clip size
+            alpha = np.pad(alpha[:, :width], ((0, 0), (0, max(width - alpha.shape[1], 0))), 'constant')
+        return alpha
+
+
+_atlas: Optional[GlyphAtlas] = None
+
+
+def get_atlas() -> GlyphAtlas:
+    global _atlas
+    if _atlas is None:
+        _atlas = GlyphAtlas(load_font())
+    return _atlas
+
+
+def frame_label(path) -> str:
+    # 25_04_2019_13-05-00.jpg -> 25.04.2019.13-05-00
+    return Path(path).name.split('.')[0].replace('_', '.')
+
+
+def timestamp_clip(sequence, fps):
+    """ Transparent clip with timestamp label of every frame of sequence
+
+    Color part is one constant array, only the mask is composed per frame, nothing is kept per frame.
+    """
+    atlas = get_atlas()
+    labels = [frame_label(path) for path in sequence]
+    width = atlas.alpha(labels[0]).shape[1]
+    color = np.empty((atlas.height, width, 3), dtype=np.uint8)
+    color[...] = atlas.color
+    last = len(labels) - 1
+    duration = len(labels) / fps
+
+    def mask_frame(t):
+        return atlas.alpha(labels[min(int(t * fps + 1e-6), last)], width) / 255
+
+    clip = VideoClip(lambda t: color, duration=duration)
+    clip.mask = VideoClip(mask_frame, ismask=True, duration=duration)
+    clip.fps = fps
+    return clip
@@ -0,0 +1,33 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+
+
+def dhash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """ Difference hash of image: sign of horizontal gradient on tiny grayscale copy
+    """
+    image = image.convert('L').resize((size + 1, size), Image.ANTIALIAS)
+    pixels = np.asarray(image, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def ahash(image: Image.Image, size: int = HASH_SIZE) -> int:
+    """ Average hash of image: pixels brighter than mean on tiny grayscale copy
+    """
+    image = image.convert('L').resize((size, size), Image.ANTIALIAS)
+    pixels = np.asarray(image, dtype=np.int16)
+    bits = pixels > pixels.mean()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+# selected by Cam.phash_algorithm
+HASHES = {
+    'dhash': dhash,
+    'ahash': ahash,
+}
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
@@ -0,0 +1,236 @@
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Optional
+
+from loguru import logger
+
+from shot import conf
+from shot.conf.model import Cam
+
+if TYPE_CHECKING:
+    from shot.shooter import Movie
+
+
+class RenderError(Exception):
+    pass
+
+
+@dataclass
+class RenderJob:
+    cam: Cam
+    day: str
+    regular: bool = True
+    # movie -- clip of the day, segments -- encode closed hours of the day,
+    # timelapse -- long range movie of `preset` ending at day
+    kind: str = 'movie'
+    preset: Optional[str] = None
+
+
+@dataclass
+class RenderResult:
+    movie: Optional['Movie'] = None
+    error: Optional[str] = None
+    # original exception when it survives pickling, so callers can handle e.g. FileNotFoundError
+    exception: Optional[Exception] = None
+    rss: int = 0
+    restart: bool = False
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def available_memory() -> Optional[int]:
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def render_concurrency() -> int:
+    """ Renders which fit the machine: one per core, but no more than memory allows
+    """
+    if conf.render_workers:
+        return conf.render_workers
+    limit = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        limit = min(limit, memory // (conf.render_job_memory * 2 ** 20))
+    return max(limit, 1)
+
+
+def portable(exc: Exception) -> Optional[Exception]:
+    try:
+        pickle.loads(pickle.dumps(exc))
+    except Exception:
+        return None
+    return exc
+
+
+def worker_main(conn, max_rss: int, root_dir: Optional[str] = None):
+    """ Render worker loop, moviepy and fonts are loaded once for all jobs
+
+    Worker exits after reply when its memory grows over `max_rss`, pool starts fresh one.
+    `root_dir` of parent is used when it was changed at runtime.
+    """
+    from shot import movie
+    if root_dir is not None:
+        conf.root_dir = root_dir
+    movie.init_logging()
+    movie.warm()
+    logger.info(f'Render worker {os.getpid()} is ready')
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        result = RenderResult()
+        try:
+            if job.kind == 'segments':
+                movie.make_segments(job.cam, job.day)
+            elif job.kind == 'timelapse':
+                result.movie = movie.make_timelapse(job.cam, job.preset, job.day)
+            else:
+                result.movie = movie.make_movie(job.cam, job.day, job.regular)
+        except Exception as exc:
+            logger.exception(f'Error during render {job.cam.name}:{job.day}')
+            result.error = f'{exc.__class__.__name__}: {exc}'
+            result.exception = portable(exc)
+        result.rss = current_rss()
+        result.restart = result.rss > max_rss
+        conn.send(result)
+        if result.restart:
+            logger.warning(f'Render worker {os.getpid()} uses {result.rss // 2 ** 20}MB, restarting')
+            return
+
+
+class RenderWorker:
+
+    def __init__(self, index: int):
+        self.index = index
+        self.proc: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.jobs = 0
+        self.restarts = 0
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.is_alive()
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child = context.Pipe()
+        self.proc = context.Process(
+            target=worker_main, args=(child, conf.render_max_rss * 2 ** 20, conf.root_dir),
+            name=f'render-{self.index}', daemon=True,
+        )
+        self.proc.start()
+        child.close()
+        logger.info(f'Started render worker {self.proc.pid}')
+
+    def stop(self, timeout=5):
+        if self.alive:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.proc.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.alive:
+            self.proc.kill()
+        if self.proc is not None:
+            self.proc.join()
+            self.conn.close()
+        self.proc = None
+
+    def render(self, job: RenderJob):
+        if not self.alive:
+            if self.proc is not None:
+                self.restarts += 1
+            self.kill()
+            self.start()
+        self.jobs += 1
+        self.conn.send(job)
+        if not self.conn.poll(conf.render_timeout):
+            self.kill()
+            raise RenderError(f'render of {job.cam.name}:{job.day} took more than {conf.render_timeout}s')
+        try:
+            result: RenderResult = self.conn.recv()
+        except EOFError:
+            self.kill()
+            raise RenderError(f'render worker died during {job.cam.name}:{job.day}')
+        if result.restart:
+            self.restarts += 1
+            self.stop()
+        if result.exception is not None:
+            raise result.exception
+        if result.error:
+            raise RenderError(result.error)
+        return result.movie
+
+
+class RenderPool:
+    """ Long-lived render workers which take jobs over pipe and return `Movie`
+
+    Replaces spawning `poetry run movie` per clip. Calls are blocking, run them in io pool.
+    """
+
+    def __init__(self):
+        self.workers: List[RenderWorker] = []
+        self._idle: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def start(self):
+        with self._lock:
+            if self.workers:
+                return
+            self.size = render_concurrency()
+            for i in range(self.size):
+                worker = RenderWorker(i)
+                worker.start()
+                self.workers.append(worker)
+                self._idle.put(worker)
+
+    def render(self, cam: Cam, day: str, regular: bool = True):
+        return self.submit(RenderJob(cam, day, regular))
+
+    def segments(self, cam: Cam, day: str):
+        return self.submit(RenderJob(cam, day, kind='segments'))
+
+    def timelapse(self, cam: Cam, preset: str, end: str):
+        return self.submit(RenderJob(cam, end, kind='timelapse', preset=preset))
+
+    def submit(self, job: RenderJob):
+        self.start()
+        worker = self._idle.get()
+        try:
+            return worker.render(job)
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
+        self.workers.clear()
+        self._idle = queue.Queue()
+
+
+renderer = RenderPool()
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import math
+import time
+from typing import Dict, List, Set
+
+from loguru import logger
+
+from shot import conf, metrics
+from shot.breaker import CLOSED
+from shot.hls import stop_grabber
+from shot.shooter import CamHandler
+
+# connection is opened this much ahead of the tick
+PREWARM_AHEAD = 2
+
+
+class CaptureScheduler:
+    """ Runs capture loop per camera at its own `Cam.interval`
+
+    Every camera gets own task with drift-corrected schedule based on monotonic clock.
+    Ticks are aligned to wall clock and shifted by phase derived from rank of `Cam.offset`,
+    so cameras are spread across the period instead of firing at once.
+    """
+
+    def __init__(self, handlers: List[CamHandler]):
+        self.handlers = handlers
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.missed: Dict[str, int] = {}
+        self.captures: Set[asyncio.Task] = set()
+
+    def start(self):
+        for handler in self.handlers:
+            name = handler.cam.name
+            self.missed[name] = 0
+            # series is exported from start, not after the first miss
+            metrics.capture_missed_ticks.inc(0, cam=name)
+            self.tasks[name] = asyncio.ensure_future(self._cam_loop(handler))
+        metrics.register_collector(self.collect)
+        logger.info(f'Capture scheduler started for {len(self.handlers)} cameras')
+
+    async def stop(self):
+        tasks = list(self.tasks.values()) + list(self.captures)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.tasks.clear()
+
+    def collect(self):
+        now = time.time()
+        for handler in self.handlers:
+            name = handler.cam.name
+            if handler.last_success is not None:
+                metrics.capture_last_success.set(now - handler.last_success, cam=name)
+
+    def phase(self, handler: CamHandler) -> float:
+        # offsets are arbitrary numbers, slot is the rank of camera ordered by offset
+        ranked = sorted(self.handlers, key=lambda h: h.cam.offset)
+        slot = next(i for i, h in enumerate(ranked) if h is handler)
+        return handler.cam.interval * slot / max(len(ranked), 1)
+
+    @staticmethod
+    def is_active(now: datetime.datetime) -> bool:
+        return conf.capture_start <= now.hour <= conf.capture_end
+
+    @staticmethod
+    async def _capture(handler: CamHandler):
+        try:
+            await handler.get_img_and_sync()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f'Error during capture for {handler.cam.name}')
+
+    async def _cam_loop(self, handler: CamHandler):
+        cam = handler.cam
+        if cam.interval <= 0:
+            logger.error(f'Wrong interval {cam.interval} for {cam.name}, capture disabled')
+            return
+        loop = asyncio.get_event_loop()
+        interval = cam.interval
+        phase = self.phase(handler)
+        wall = time.time()
+        first = math.ceil((wall - phase) / interval) * interval + phase
+        anchor = loop.time() + first - wall
+        logger.info(f'Capture loop for {cam.name}: interval {interval}s, phase {phase:.2f}s')
+        prewarm = handler.client.needs_prewarm(cam)
+        tick = 0
+        while True:
+            due = anchor + tick * interval
+            if prewarm and due - loop.time() > PREWARM_AHEAD:
+                # keep-alive connection is gone after long idle, so fresh one is opened ahead of the tick
+                await asyncio.sleep(due - PREWARM_AHEAD - loop.time())
+                if self.is_active(datetime.datetime.now()) and handler.breaker.state == CLOSED:
+                    task = asyncio.ensure_future(handler.client.prewarm(cam))
+                    self.captures.add(task)
+                    task.add_done_callback(self.captures.discard)
+            await asyncio.sleep(max(due - loop.time(), 0))
+            if self.is_active(datetime.datetime.now()):
+                # overlapping captures are handled by single-flight policy of handler
+                task = asyncio.ensure_future(self._capture(handler))
+                self.captures.add(task)
+                task.add_done_callback(self.captures.discard)
+            elif cam.hls_persistent:
+                # no ffmpeg decoding stream outside capture hours, first active tick starts it again
+                await stop_grabber(cam)
+            # next tick is computed from anchor, so slow event loop does not accumulate drift
+            elapsed = int((loop.time() - anchor) // interval)
+            if elapsed > tick:
+                self.missed[cam.name] += elapsed - tick
+                metrics.capture_missed_ticks.inc(elapsed - tick, cam=cam.name)
+                logger.warning(f'Capture for {cam.name} missed {elapsed - tick} tick(s)')
+            tick = max(tick, elapsed) + 1
@@ -0,0 +1,121 @@
+import datetime
+import json
+import os
+import shutil
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from dataclasses_json import dataclass_json
+from loguru import logger
+
+from shot import conf
+from shot.conf.model import Cam
+from shot.encode import fingerprint, get_profile
+
+INDEX_NAME = 'index.json'
+KEEP_DAYS = 8
+
+
+@dataclass_json
+@dataclass
+class Segment:
+    """ Encoded hour of frames, it is valid while frames of the hour are the same
+    """
+    frames: int
+    last: str
+    width: int
+    height: int
+    fps: int
+    backend: str
+    encode: Optional[str] = None
+    # frames in video, less than `frames` when thinned by activity
+    encoded: Optional[int] = None
+
+    @property
+    def length(self) -> int:
+        return self.encoded or self.frames
+
+
+def segment_key(cam: Cam) -> str:
+    """ Settings segment is made with, segments made with other settings are re-encoded
+    """
+    return f'{fingerprint(get_profile(cam))}:{cam.frame_budget}:{cam.target_duration}'
+
+
+def segments_dir(cam: Cam, day: str) -> Path:
+    return Path(conf.root_dir) / 'data' / cam.name / 'regular' / 'segments' / day
+
+
+def segment_path(cam: Cam, day: str, hour: str) -> Path:
+    return segments_dir(cam, day) / f'{hour}.mp4'
+
+
+def frame_hour(path) -> str:
+    # dd_mm_yyyy_HH-MM-SS.jpg
+    return Path(path).name[11:13]
+
+
+def group_by_hour(sequence: List[str]) -> Dict[str, List[str]]:
+    hours = OrderedDict()
+    for item in sequence:
+        hours.setdefault(frame_hour(item), []).append(item)
+    return hours
+
+
+def load_index(cam: Cam, day: str) -> Dict[str, Segment]:
+    path = segments_dir(cam, day) / INDEX_NAME
+    if not path.exists():
+        return {}
+    try:
+        with open(path) as f:
+            return {hour: Segment.from_dict(item) for hour, item in json.load(f).items()}
+    except Exception:
+        logger.exception(f'Broken segments index {path}')
+        return {}
+
+
+def save_index(cam: Cam, day: str, index: Dict[str, Segment]):
+    path = segments_dir(cam, day) / INDEX_NAME
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        json.dump({hour: segment.to_dict() for hour, segment in index.items()}, f)
+    os.replace(tmp, path)
+
+
+def is_valid(cam: Cam, day: str, hour: str, segment: Optional[Segment], frames: List[str]) -> bool:
+    return (
+        segment is not None
+        and segment.frames == len(frames)
+        and segment.last == Path(frames[-1]).name
+        and segment.fps == cam.fps
+        and segment.backend == cam.backend
+        and segment.encode == segment_key(cam)
+        and segment_path(cam, day, hour).exists()
+    )
+
+
+def is_closed(day: str, hour: str, now: Optional[datetime.datetime] = None) -> bool:
+    now = now or datetime.datetime.now()
+    if day != now.strftime('%d_%m_%Y'):
+        return True
+    return int(hour) < now.hour
+
+
+def prune_segments(cam: Cam, keep_days: int = KEEP_DAYS):
+    """ Segments are kept for weekly movie only
+    """
+    root = Path(conf.root_dir) / 'data' / cam.name / 'regular' / 'segments'
+    if not root.exists():
+        return
+    border = datetime.date.today() - datetime.timedelta(days=keep_days)
+    for folder in root.iterdir():
+        try:
+            day = datetime.datetime.strptime(folder.name, '%d_%m_%Y').date()
+        except ValueError:
+            continue
+        if day < border:
+            logger.info(f'Removing old segments {folder}')
+            shutil.rmtree(folder)
@@ -1,32 +1,46 @@
 import asyncio
-import concurrent
 import datetime
 import hashlib
-import io
 import os
 import subprocess as sp
-from dataclasses import dataclass
+import time
+import uuid
+from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional
 
 import aiohttp
-import imageio
+import async_timeout
 import pendulum
 from PIL import Image
 from loguru import logger
-from moviepy.video.VideoClip import TextClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from moviepy.video.io.ImageSequenceClip import ImageSequenceClip
 
-from shot import conf
+from shot import conf, metrics
+from shot.breaker import CircuitBreaker, get_breaker
+from shot.camclient import CamClient, cam_client
 from shot.conf.model import Cam
+from shot.encode import get_profile
+from shot.ffmpeg import concat_segments, extract_frame
+from shot.jpeg import sniff
+from shot.overlay import timestamp_clip
+from shot.hls import get_grabber
+from shot.ingest import GrayCheckError, ingest_img
+from shot.journal import CamState, get_state, save_state
+from shot.render import renderer
+from shot.segments import load_index, prune_segments, segment_path
+from shot.sidecar import remove_sidecar, thumb_path, write_sidecar
+from shot.timelapse import DAY_FORMAT, PRESETS, Timelapse, seconds
+from shot.workers import workers
 
 PIPE = -1
 STDOUT = -2
 DEVNULL = -3
+CHUNK_SIZE = 64 * 1024
 
 
-class GrayCheckError(Exception):
+class DownloadError(Exception):
     pass
 
 
@@ -62,6 +76,7 @@ class Movie:
     width: int
     path: Path
     thumb: Path
+    frames: int = 0
 
 
 @dataclass
@@ -82,127 +97,328 @@ class ImageItem:
 @dataclass
 class CamHandler:
     cam: Cam
-    session: aiohttp.ClientSession
+    client: CamClient = cam_client
     previous_image: Optional[str] = None
-    path: Optional[Path] = None
-    executor: concurrent.futures.ThreadPoolExecutor = concurrent.futures.ThreadPoolExecutor()
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: int = 0
+    validators_ignored: int = 0
+    previous_phash: Optional[int] = None
+    similar: int = 0
+    state: Optional[CamState] = None
+    skipped: int = 0
+    coalesced: int = 0
+    late: int = 0
+    last_success: Optional[float] = None
+    _inflight: Optional[asyncio.Future] = field(default=None, repr=False)
+    _queued: bool = field(default=False, repr=False)
+    breaker: Optional[CircuitBreaker] = field(default=None, repr=False)
+
+    def __post_init__(self):
+        if self.breaker is None:
+            self.breaker = get_breaker(self.cam)
+
+    @classmethod
+    def from_journal(cls, cam: Cam, client: CamClient = cam_client):
+        """ Handler for regular captures which restores and keeps capture state in journal
+        """
+        state = get_state(cam)
+        return cls(
+            cam, client, previous_image=state.last_hash, etag=state.etag,
+            last_modified=state.last_modified, previous_phash=state.last_phash, state=state,
+            not_modified=state.not_modified, validators_ignored=state.validators_ignored,
+        )
 
     async def get_img(self, regular=True):
+        if not self.breaker.allow():
+            logger.debug(f'Circuit for {self.cam.name} is {self.breaker.state}, skip capture')
+            self.count('circuit_open')
+            return
         logger.info(f'Img handler: {self.cam.name}')
         regular = 'regular' if regular else ''
         today = datetime.datetime.now().strftime('%d_%m_%Y')
-        path = Path(conf.root_dir) / 'data' / self.cam.name
-        path = path / regular / 'imgs' / today
-        path.mkdir(parents=True, exist_ok=True)
+        folder = Path(conf.root_dir) / 'data' / self.cam.name / regular / 'imgs' / today
+        folder.mkdir(parents=True, exist_ok=True)
         now = datetime.datetime.now().strftime('%d_%m_%Y_%H-%M-%S')
-        self.path = path / f'{now}.jpg'
-        logger.info(f'Attempt to get img {self.path}')
+        # path is local, overlapping captures must not share it
+        path = folder / f'{now}.jpg'
+        logger.info(f'Attempt to get img {path}')
         if not self.cam.url.endswith('m3u8'):
+            headers = self.conditional_headers()
             try:
-                response = await self.session.get(self.cam.url)
+                response = await self.client.get(self.cam, headers=headers)
             except Exception:
-                logger.exception(f'Exception during getting img {self.path}')
+                logger.exception(f'Exception during getting img {path}')
+                self.failed()
+                return
+            if response.status == 304:
+                await response.release()
+                self.breaker.success()
+                self.not_modified += 1
+                logger.warning(f'Got the same image again {path}: not modified')
+                self.count('not_modified')
+                self.save_counters()
                 return
             if response.status != 200:
                 body = await response.read()
-                logger.warning(f'Can not get img {self.path}: response status {response.status} body: {body}')
+                logger.warning(f'Can not get img {path}: response status {response.status} body: {body}')
+                self.failed()
                 return
-            data = await response.read()
-            if not data:
-                logger.warning(f'Empty file data {self.path}')
+            try:
+                tmp, current = await self.download(response, path)
+            except DownloadError as exc:
+                logger.warning(f'Can not download img {path}: {exc}')
+                self.failed()
                 return
-            if self.is_the_same(data):
-                logger.warning(f'Got the same image again {self.path}')
+            except Exception:
+                logger.exception(f'Exception during downloading img {path}')
+                self.failed()
                 return
-            image = await self.save_img(data)
-            logger.info(f'Finished with {self.path}')
+            self.breaker.success()
+            if self.is_the_same(current, path):
+                tmp.unlink()
+                if headers:
+                    self.record_ignored_validators()
+                self.remember_validators(response)
+                logger.warning(f'Got the same image again {path}')
+                self.count('duplicate')
+                return
+            image = await self.store(tmp, path)
+            self.remember_validators(response)
             return image
         else:
-            cmd = [
-                'ffmpeg',
-                '-i',
-                self.cam.url,
-                '-vframes',
-                '1',
-                '-f',
-                'image2pipe',
-                '-c:v',
-                'mjpeg',
-                '-',
-            ]
-            loop = asyncio.get_event_loop()
-            with concurrent.futures.ThreadPoolExecutor() as pool:
+            data = None
+            if self.cam.hls_persistent:
+                data = await get_grabber(self.cam).frame()
+            if data is None:
                 try:
-                    data = await loop.run_in_executor(pool, lambda: subprocess_call(cmd))
+                    data = await self.get_single_frame()
                 except Exception:
                     logger.exception('Error during subprocess call')
-                else:
-                    image = await self.save_img(data)
-                    logger.info(f'Finished with {self.path}')
-                    return image
-
-    def is_the_same(self, data):
+                    self.failed()
+                    return
+            self.breaker.success()
+            if self.is_the_same(hashlib.md5(data).hexdigest(), path):
+                logger.warning(f'Got the same image again {path}')
+                self.count('duplicate')
+                return
+            tmp = self.tmp_path(path)
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            return await self.store(tmp, path)
+
+    async def store(self, tmp: Path, path: Path):
+        original, size = None, None
+        if self.cam.resize:
+            # path data/cam_name/imgs/dd_mm_yyyy/dd_mm_yyyy_timestamp.jpg
+            original = path.parent.parent / 'original' / path.parent.name / path.name
+            original.parent.mkdir(parents=True, exist_ok=True)
+            size = tuple(int(i) for i in self.cam.resize.split('x'))
+        try:
+            result = await workers.run_cpu(
+                ingest_img, tmp, path, original, size, self.previous_phash, self.cam.phash_threshold,
+                self.cam.phash_algorithm,
+                cam=self.cam.name,
+            )
+        except GrayCheckError:
+            logger.info(f'Remove file due to check error {path}')
+            self.count('rejected')
+            return
+        if result.similar:
+            self.similar += 1
+        if result.phash is not None and not result.similar:
+            # reference is the last stored frame, so slow changes are accumulated
+            self.previous_phash = result.phash
+        if not result.stored:
+            logger.warning(f'Got similar image {path}')
+            self.count('similar')
+            return
+        logger.info(f'Finished with {path}')
+        self.count('stored')
+        return ImageItem(self.cam, path, original_path=original)
+
+    def count(self, result: str):
+        metrics.capture_total.inc(cam=self.cam.name, result=result)
+
+    def failed(self):
+        self.count('failed')
+        self.breaker.failure()
+
+    def tmp_path(self, path: Path):
+        # temp files live on the same filesystem as day folders, so rename into place is atomic
+        tmp = Path(conf.root_dir) / 'data' / self.cam.name / 'tmp' / f'{path.stem}.{uuid.uuid4().hex[:8]}.part'
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        return tmp
+
+    async def download(self, response: aiohttp.ClientResponse, path: Path):
+        """ Streams response body to temp file with size cap and read deadline
+
+        Returns temp file path and md5 of the body calculated on the fly.
+        """
+        tmp = self.tmp_path(path)
+        md5 = hashlib.md5()
+        size = 0
+        start = time.monotonic()
+        try:
+            async with async_timeout.timeout(self.cam.read_timeout):
+                with open(tmp, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.cam.max_size:
+                            raise DownloadError(f'body exceeds {self.cam.max_size} bytes')
+                        md5.update(chunk)
+                        f.write(chunk)
+        except asyncio.TimeoutError:
+            response.close()
+            tmp.unlink()
+            raise DownloadError(f'body was not read in {self.cam.read_timeout}s')
+        except BaseException:
+            response.close()
+            tmp.unlink()
+            raise
+        if not size:
+            tmp.unlink()
+            raise DownloadError('empty file data')
+        metrics.http_seconds.observe(time.monotonic() - start, cam=self.cam.name, phase='read')
+        return tmp, md5.hexdigest()
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def remember_validators(self, response):
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+
+    def record_ignored_validators(self):
+        # camera sent validators but answered 200 with unchanged body, so conditional requests do not help
+        if not self.validators_ignored:
+            logger.info(f'Cam {self.cam.name} ignores conditional request headers')
+        self.validators_ignored += 1
+        metrics.capture_validators_ignored.inc(cam=self.cam.name)
+        self.save_counters()
+
+    def save_counters(self):
+        # captures which store no frame change only these counters, so journal is saved right away
+        if self.state is None:
+            return
+        self.state.not_modified = self.not_modified
+        self.state.validators_ignored = self.validators_ignored
+        try:
+            save_state(self.cam)
+        except Exception:
+            logger.exception(f'Can not save state journal for {self.cam.name}')
+
+    async def get_single_frame(self):
+        cmd = [
+            'ffmpeg',
+            '-i',
+            self.cam.url,
+            '-vframes',
+            '1',
+            '-f',
+            'image2pipe',
+            '-c:v',
+            'mjpeg',
+            '-',
+        ]
+        return await workers.run_io(subprocess_call, cmd, cam=self.cam.name)
+
+    def is_the_same(self, current, path: Path):
         if not self.previous_image:
             last = None
             try:
-                last = sorted(self.path.parent.iterdir())[-1]
+                last = sorted(path.parent.iterdir())[-1]
             except IndexError:
                 pass
             if not last:
-                self.previous_image = hashlib.md5(data).hexdigest()
+                self.previous_image = current
                 return False
             with open(last, 'rb') as _last:
                 last_data = _last.read()
             self.previous_image = hashlib.md5(last_data).hexdigest()
-        current = hashlib.md5(data).hexdigest()
         equal = current == self.previous_image
         if not equal:
             self.previous_image = current
         return equal
 
-    async def save_img(self, data):
-        if not self.cam.resize:
-            with open(self.path, 'wb') as f:
-                f.write(data)
-            return ImageItem(self.cam, self.path)
-        # path data/cam_name/imgs/dd_mm_yyyy/dd_mm_yyyy_timestamp.jpg
-        original = self.path.parent.parent / 'original' / self.path.parent.name / self.path.name
-        original.parent.mkdir(parents=True, exist_ok=True)
-        with open(original, 'wb') as f:
-            f.write(data)
-        size = tuple(int(i) for i in self.cam.resize.split('x'))
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, lambda: resize_img(data, size, self.path))
-        return ImageItem(self.cam, self.path, original_path=original)
-
-    async def single_image_gray_check(self, item: ImageItem):
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, lambda: self._single_image_gray_check(item.path))
-
-    @staticmethod
-    def _single_image_gray_check(path):
-        logger.debug(f'Gray check {path}')
-        try:
-            image = imageio.imread(path)
-        except ValueError:
-            raise GrayCheckError
-        except Exception:
-            logger.exception(f'Can not read file {path}')
-            raise GrayCheckError
-        if len(image.shape) < 3:
-            convert_gray_to_rgb(path)
-        return path
-
     async def get_img_and_sync(self, regular=True):
-        image = await self.get_img(regular)
+        """ Single-flight capture, overlapping call is handled according to `Cam.overlap`
+
+        skip -- drop the tick, coalesce -- share result of capture in flight,
+        queue -- run once more after capture in flight (only one tick is queued).
+        """
+        if self._inflight is not None and not self._inflight.done():
+            if self.cam.overlap == 'coalesce':
+                self.coalesced += 1
+                logger.warning(f'Capture for {self.cam.name} is in flight, coalesce')
+                self.count('coalesced')
+                return await asyncio.shield(self._inflight)
+            if self.cam.overlap != 'queue' or self._queued:
+                self.skipped += 1
+                logger.warning(f'Capture for {self.cam.name} is in flight, skip')
+                self.count('skipped')
+                return
+            self._queued = True
+            try:
+                await asyncio.wait({self._inflight})
+            finally:
+                self._queued = False
+        self._inflight = asyncio.ensure_future(self._capture(regular))
+        return await asyncio.shield(self._inflight)
+
+    async def _capture(self, regular):
+        deadline = self.cam.deadline or self.cam.interval
+        start = time.monotonic()
+        try:
+            image = await asyncio.wait_for(self.get_img(regular), timeout=deadline)
+        except asyncio.TimeoutError:
+            self.late += 1
+            self.breaker.failure()
+            logger.warning(f'Capture for {self.cam.name} exceeded deadline {deadline}s')
+            self.count('late')
+            return
         if not image:
             return
+        metrics.capture_seconds.observe(time.monotonic() - start, cam=self.cam.name)
+        self.last_success = time.time()
+        size = image.path.stat().st_size
+        if image.original_path:
+            size += image.original_path.stat().st_size
+        metrics.capture_bytes.inc(size, cam=self.cam.name)
+        if self.state is not None:
+            self.update_state(image)
+        return image
+
+    def update_state(self, image: ImageItem):
+        state = self.state
+        day = image.path.parent.name
+        if state.day != day:
+            # first frame of the day, folder is almost empty so walking it is cheap
+            count, size = get_count_and_size(image.path.parent)
+            original_count, original_size = 0, 0
+            if image.original_path:
+                original_count, original_size = get_count_and_size(image.original_path.parent)
+            state.rollover(day, count, size, original_count, original_size)
+        else:
+            state.frames += 1
+            state.bytes += image.path.stat().st_size
+            if image.original_path:
+                state.original_frames += 1
+                state.original_bytes += image.original_path.stat().st_size
+        state.last_hash = self.previous_image
+        state.last_phash = self.previous_phash
+        state.etag = self.etag
+        state.last_modified = self.last_modified
+        state.last_capture = datetime.datetime.now().isoformat()
         try:
-            await self.single_image_gray_check(image)
-        except GrayCheckError:
-            logger.info('Remove file due to check error')
-            image.clear()
-            return
+            save_state(self.cam)
+        except Exception:
+            logger.exception(f'Can not save state journal for {self.cam.name}')
 
 
 def seq_middle(seq):
@@ -223,77 +439,56 @@ def convert_gray_to_rgb(path):
 def image_gray_check(path):
     logger.debug(f'Gray check {path}')
     try:
-        image = imageio.imread(path)
+        info = sniff(path)
     except Exception:
         logger.exception(f'Can not read file {path}')
         return
-    if len(image.shape) < 3:
+    if not info.complete:
+        logger.warning(f'Skip truncated file {path}')
+        return
+    if info.gray:
         convert_gray_to_rgb(path)
     return path
 
 
-def check_sequence_for_gray_images(sequence, executor):
+def check_sequence_for_gray_images(sequence):
     logger.debug('Checking sequence for gray images')
     converted = []
-    for item in executor.map(image_gray_check, sequence):
+    for item in map(image_gray_check, sequence):
         if item is not None:
             converted.append(item)
     return converted
 
 
-def ts_clip(path):
-    logger.debug(f'Txt frame with timestamp {path}')
-    label = path.split('/')[-1].split('.')[0].replace('_', '.')
-    txt = TextClip(txt=label, fontsize=20, color="red", font='Ubuntu-Bold', transparent=True)
-    return txt.get_frame(0)
-
-
-def make_txt_movie(sequence, fps, executor):
+def make_txt_movie(sequence, fps):
     logger.debug('Creating txt movie..')
-    txt_clip = []
-    for item in executor.map(ts_clip, sequence):
-        txt_clip.append(item)
-    return ImageSequenceClip(txt_clip, fps=fps)
+    return timestamp_clip(sequence, fps)
 
 
 def make_movie(cam: Cam, day: str, regular: bool = True):
-    regular = 'regular' if regular else ''
     root = Path(conf.root_dir) / 'data' / cam.name
     path = root / 'regular' / 'imgs' / day
     logger.info(f'Running make movie for {path}:{day}')
-    sequence = sorted(str(p) for p in path.iterdir())
-    movie_path = root / regular / 'clips' / f'{day}.mp4'
-    cmd = [
-        'poetry',
-        'run',
-        'movie',
-        '--cam_name',
-        cam.name,
-        '--day',
-        day,
-    ]
-    if regular:
-        cmd.append('--regular')
+    frames = sum(1 for _ in path.iterdir())
+    kind = 'daily' if regular else 'today'
+    start = time.monotonic()
     try:
-        subprocess_call(cmd)
+        movie = renderer.render(cam, day, regular)
     except Exception:
-        logger.exception('Error during subprocess call')
+        logger.exception(f'Error during render {cam.name}:{day}')
+        metrics.render_failed.inc(cam=cam.name, kind=kind)
         raise
-    cover = sequence[seq_middle(sequence)]
-    cover = Path(cover)
-    with Image.open(cover) as img:
-        width, height = img.size
-    return Movie(height, width, movie_path, cover)
+    observe_render(cam, kind, time.monotonic() - start, movie.frames or frames, movie.path)
+    return movie
 
 
-def _make_movie(cam: Cam, day: str, regular: bool = True, executor=None):
+def _make_movie(cam: Cam, day: str, regular: bool = True):
     regular = 'regular' if regular else ''
     root = Path(conf.root_dir) / 'data' / cam.name
     path = root / 'regular' / 'imgs' / day
     logger.info(f'Running make movie for {path}:{day}')
-    # sequence = check_sequence_for_gray_images(sorted(str(p) for p in path.iterdir()), executor)
-    sequence = sorted(str(p) for p in path.iterdir())
-    txt_clip = make_txt_movie(sequence, cam.fps, executor=executor)
+    sequence = check_sequence_for_gray_images(sorted(str(p) for p in path.iterdir()))
+    txt_clip = make_txt_movie(sequence, cam.fps)
     logger.info(f'Composing clip for {path}:{day}')
     image_clip = ImageSequenceClip(sequence, fps=cam.fps)
     logger.info(f'ImageSequenceClip ready')
@@ -305,39 +500,80 @@ def _make_movie(cam: Cam, day: str, regular: bool = True, executor=None):
     return Movie(clip.h, clip.w, movie_path, sequence[seq_middle(sequence)])
 
 
-def make_weekly_movie(cam: Cam, executor):
-    root = Path(conf.root_dir) / 'data' / cam.name
-    path = root / 'regular' / 'imgs'
-    start = pendulum.yesterday()
-    logger.info(f'Running make weekly movie for ww{start.week_of_year}')
-    week_ago = start.subtract(weeks=1).date()
-    sequence = []
-    morning = pendulum.Time(6)
-    evening = pendulum.Time(18)
-    for day in sorted(list(path.iterdir()), key=lambda x: pendulum.from_format(x.name, 'DD_MM_YYYY')):
-        if pendulum.from_format(day.name, 'DD_MM_YYYY').date() > week_ago:
-            for img in sorted(day.iterdir()):
-                t_img = img.name.split('.')[0]
-                t_img = pendulum.from_format(t_img, 'DD_MM_YYYY_HH-mm-ss').time()
-                if morning < t_img < evening:
-                    sequence.append(str(img))
-    sequence = check_sequence_for_gray_images(sequence, executor)
-    txt_clip = make_txt_movie(sequence, 100, executor)
-    logger.info(f'Composing clip for weekly movie ww{start.week_of_year}')
-    image_clip = ImageSequenceClip(sequence, fps=100)
-    clip = CompositeVideoClip([image_clip, txt_clip.set_position(('right', 'top'))], use_bgclip=True)
-    movie_path = root / 'regular' / 'weekly' / f'ww{start.week_of_year}.mp4'
-    movie_path.parent.mkdir(parents=True, exist_ok=True)
-    clip.write_videofile(str(movie_path), audio=False)
-    logger.info(f'Finished with clip for weekly movie ww{start.week_of_year}')
-    return Movie(clip.h, clip.w, movie_path, sequence[seq_middle(sequence)])
+def observe_render(cam: Cam, kind: str, seconds: float, frames: int, path: Path):
+    metrics.render_seconds.observe(seconds, cam=cam.name, kind=kind)
+    metrics.render_frames.inc(frames, cam=cam.name, kind=kind)
+    metrics.render_output_bytes.set(path.stat().st_size, cam=cam.name, kind=kind)
+    if seconds:
+        metrics.render_fps.set(frames / seconds, cam=cam.name, kind=kind)
 
 
-def resize_img(data, size, path):
-    logger.debug(f'Resizing image {path}')
-    image = Image.open(io.BytesIO(data))
-    image.thumbnail(size, Image.ANTIALIAS)
-    image.save(path, format='JPEG')
+def make_weekly_movie(cam: Cam):
+    if cam.incremental:
+        movie = make_weekly_from_segments(cam, PRESETS['weekly'], datetime.date.today())
+        if movie is not None:
+            return movie
+    return make_timelapse(cam, 'weekly')
+
+
+def make_timelapse(cam: Cam, preset: str, end: Optional[datetime.date] = None):
+    end = end or datetime.date.today()
+    logger.info(f'Running make {preset} movie for {cam.name} till {end}')
+    start = time.monotonic()
+    try:
+        movie = renderer.timelapse(cam, preset, end.strftime(DAY_FORMAT))
+    except Exception:
+        logger.exception(f'Error during render {preset} movie for {cam.name}')
+        metrics.render_failed.inc(cam=cam.name, kind=preset)
+        raise
+    observe_render(cam, preset, time.monotonic() - start, movie.frames, movie.path)
+    return movie
+
+
+def make_segments(cam: Cam, day: str):
+    logger.info(f'Updating segments for {cam.name}:{day}')
+    renderer.segments(cam, day)
+    prune_segments(cam)
+
+
+def make_weekly_from_segments(cam: Cam, spec: Timelapse, end: datetime.date) -> Optional[Movie]:
+    """ Joins hourly segments inside time window of preset, retimed to its fps
+
+    Returns None when segments can not be joined as is, so the week is rendered from frames.
+    """
+    start_render = time.monotonic()
+    first, last = seconds(spec.start) // 3600, seconds(spec.end) // 3600
+    segments, frames = [], 0
+    for offset in range(spec.days - 1, -1, -1):
+        day = (end - datetime.timedelta(days=offset)).strftime(DAY_FORMAT)
+        if (Path(conf.root_dir) / 'data' / cam.name / 'regular' / 'imgs' / day).exists():
+            renderer.segments(cam, day)
+        for hour, segment in sorted(load_index(cam, day).items()):
+            if first <= int(hour) < last and segment_path(cam, day, hour).exists():
+                segments.append((segment_path(cam, day, hour), segment))
+                frames += segment.length
+    sizes = {(segment.width, segment.height) for _, segment in segments}
+    if len(sizes) != 1:
+        logger.warning(f'Can not make {spec.name} movie of {cam.name} from segments: sizes {sizes}')
+        return
+    target = get_profile(cam).target_size
+    total = sum(p.stat().st_size for p, _ in segments)
+    if target and total > target * 2 ** 20:
+        # joined segments keep their bitrate, only frame render fits the week into target
+        logger.warning(f'Segments of {spec.name} movie of {cam.name} take {total} bytes, over target')
+        return
+    root = Path(conf.root_dir) / 'data' / cam.name
+    movie_path = root / 'regular' / spec.name / f'{spec.label(end)}.mp4'
+    concat_segments([p for p, _ in segments], movie_path, root / 'tmp', speed=spec.fps / cam.fps)
+    width, height = sizes.pop()
+    cover = root / 'tmp' / f'{movie_path.stem}.cover.jpg'
+    extract_frame(segments[len(segments) // 2][0], cover)
+    try:
+        write_sidecar(movie_path, width, height, frames, spec.fps, get_profile(cam).codec, cover)
+    finally:
+        cover.unlink()
+    observe_render(cam, spec.name, time.monotonic() - start_render, frames, movie_path)
+    return Movie(height, width, movie_path, thumb_path(movie_path), frames)
 
 
 def stats(day=None):
@@ -349,11 +585,18 @@ def stats(day=None):
     total = 0
     for cam in conf.cameras.keys():
         root_path = root / cam / 'regular' / 'imgs'
-        count, total_size = get_count_and_size(root_path / day)
+        state = get_state(conf.cameras[cam])
+        if state.day == day:
+            count, total_size = state.frames, state.bytes
+        else:
+            count, total_size = get_count_and_size(root_path / day)
         result['cameras'][cam] = {'size': total_size, 'count': count}
         total += total_size
         if conf.cameras[cam].resize:
-            original_count, original_total_size = get_count_and_size(root_path / 'original' / day)
+            if state.day == day:
+                original_count, original_total_size = state.original_frames, state.original_bytes
+            else:
+                original_count, original_total_size = get_count_and_size(root_path / 'original' / day)
             result['cameras'][f'{cam}-original'] = {'size': original_total_size, 'count': original_count}
             total += original_total_size
     result['total'] = total
@@ -381,6 +624,10 @@ def clear_cam_storage(day, cam: Cam):
     path = root_path / day
     logger.info(f'Clearing {path}')
     clear_path(path)
+    state = get_state(cam)
+    if state.day == day:
+        state.rollover(day)
+        save_state(cam)
     if cam.resize:
         logger.info(f'Clearing {path}')
         path = root_path / 'original' / day
@@ -391,6 +638,7 @@ def clear_cam_storage(day, cam: Cam):
         clip_path.unlink()
     except FileNotFoundError:
         logger.warning(f'Clip not found for {day}')
+    remove_sidecar(clip_path)
 
 
 def clear_path(path: Path):
@@ -403,3 +651,8 @@ def clear_path(path: Path):
 def get_free_disk_space():
     statvfs = os.statvfs('/')
     return statvfs.f_frsize * statvfs.f_bavail
+
+
+@metrics.register_collector
+def collect_disk_free():
+    metrics.disk_free.set(get_free_disk_space())
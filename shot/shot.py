@@ -1,5 +1,4 @@
 import asyncio
-import datetime
 import logging
 import signal
 import sys
@@ -8,12 +7,17 @@ from asyncio.runners import _cancel_all_tasks
 from pathlib import Path
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
 from loguru import logger
 
-from shot import conf
+from shot import conf, metrics
 from shot.bot import CamBot
+from shot.camclient import cam_client
+from shot.hls import stop_grabbers
+from shot.jobs import render_queue
+from shot.render import renderer
+from shot.scheduler import CaptureScheduler
 from shot.shooter import CamHandler
+from shot.workers import workers
 
 
 def init_logging():
@@ -71,24 +75,25 @@ def run():
 
     bot = CamBot()
     scheduler = AsyncIOScheduler()
-    handlers = [CamHandler(cam, bot.session, None) for cam in conf.cameras_list]
-
-    cron_expression = '0-59/1 5-22 * * *'
+    handlers = [CamHandler.from_journal(cam) for cam in conf.cameras_list]
+    capture = CaptureScheduler(handlers)
+    runners = []
 
     async def main():
+        if conf.metrics_port:
+            runners.append(await metrics.start_server(conf.metrics_port))
         scheduler.start()
-        for handler in handlers:
-            scheduler.add_job(
-                handler.get_img_and_sync,
-                trigger=CronTrigger.from_crontab(cron_expression),
-                seconds=handler.cam.interval,
-                next_run_time=datetime.datetime.now()
-            )
+        await workers.warm()
+        renderer.start()
+        await render_queue.start()
+        capture.start()
         scheduler.add_job(bot.daily_movie_group, 'cron', hour=23, minute=1)
+        scheduler.add_job(bot.segments_group, 'cron', minute=2)
         scheduler.add_job(bot.daily_photo_group, 'cron', hour=10, minute=10)
 
         # asyncio.create_task(mem_trace())
         asyncio.create_task(bot.loop())
+        asyncio.create_task(bot.backfill())
         await bot.notify_admins('Ready! Use /menu, /stats')
 
     loop.run_until_complete(main())
@@ -96,6 +101,14 @@ def run():
     loop.run_until_complete(bot.notify_admins('Going to restart services..'))
     bot.stop()
     scheduler.shutdown()
+    loop.run_until_complete(capture.stop())
+    loop.run_until_complete(render_queue.stop())
+    loop.run_until_complete(stop_grabbers())
+    loop.run_until_complete(cam_client.close())
+    workers.shutdown()
+    renderer.shutdown()
+    for runner in runners:
+        loop.run_until_complete(runner.cleanup())
     _cancel_all_tasks(loop)
     loop.run_until_complete(loop.shutdown_asyncgens())
     logger.success('Service has been stopped')
@@ -0,0 +1,94 @@
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+from dataclasses_json import dataclass_json
+from loguru import logger
+
+# Telegram ignores thumbnails over these limits
+THUMB_SIZE = 320
+THUMB_MAX_BYTES = 200 * 1024
+THUMB_QUALITY = 85
+MIN_QUALITY = 40
+
+
+@dataclass_json
+@dataclass
+class ClipMeta:
+    """ Sidecar of rendered clip, delivery reads it instead of probing video or cover
+    """
+    width: int
+    height: int
+    duration: float
+    frames: int
+    size: int
+    codec: str
+    thumb: Optional[str] = None
+
+
+def sidecar_path(clip: Path) -> Path:
+    return clip.with_suffix('.json')
+
+
+def thumb_path(clip: Path) -> Path:
+    return clip.with_suffix('.thumb.jpg')
+
+
+def make_thumb(cover: Path, path: Path):
+    """ JPEG preview of cover which fits into Telegram thumbnail limits
+    """
+    image = Image.open(cover)
+    # JPEG is decoded at reduced scale right away, full size cover is not read
+    image.draft('RGB', (THUMB_SIZE, THUMB_SIZE))
+    image = image.convert('RGB')
+    image.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.ANTIALIAS)
+    quality = THUMB_QUALITY
+    while True:
+        image.save(path, format='JPEG', quality=quality)
+        if path.stat().st_size <= THUMB_MAX_BYTES or quality <= MIN_QUALITY:
+            return
+        quality -= 15
+
+
+def write_sidecar(clip: Path, width: int, height: int, frames: int, fps: float, codec: str,
+                  cover: Optional[Path] = None) -> ClipMeta:
+    thumb = None
+    if cover is not None:
+        try:
+            make_thumb(cover, thumb_path(clip))
+            thumb = thumb_path(clip).name
+        except Exception:
+            logger.exception(f'Can not make thumbnail of {clip} from {cover}')
+    meta = ClipMeta(width, height, round(frames / fps, 3), frames, clip.stat().st_size, codec, thumb)
+    tmp = sidecar_path(clip).with_suffix('.tmp')
+    with open(tmp, 'w') as f:
+        f.write(meta.to_json())
+    os.replace(tmp, sidecar_path(clip))
+    return meta
+
+
+def read_sidecar(clip: Path) -> Optional[ClipMeta]:
+    """ Metadata of clip, None when there is no sidecar or clip was changed after it
+    """
+    path = sidecar_path(clip)
+    try:
+        with open(path) as f:
+            meta = ClipMeta.from_dict(json.load(f))
+        if meta.size != clip.stat().st_size:
+            logger.warning(f'Sidecar {path} is stale')
+            return None
+        return meta
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.exception(f'Can not read sidecar {path}')
+        return None
+
+
+def remove_sidecar(clip: Path):
+    for path in (sidecar_path(clip), thumb_path(clip)):
+        if path.exists():
+            path.unlink()
@@ -0,0 +1,120 @@
+import datetime
+import os
+from bisect import bisect_left
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+DAY_FORMAT = '%d_%m_%Y'
+
+
+@dataclass
+class Timelapse:
+    """ Long range movie made of frames picked by time of day
+
+    Frames inside `start`-`end` window of each day are taken: all of them, one per `step`
+    minutes, or the single one nearest to `at`. With `budget` the result is thinned
+    evenly to at most that many frames.
+    """
+    name: str
+    days: int
+    start: str = '00:00'
+    end: str = '24:00'
+    step: Optional[int] = None
+    at: Optional[str] = None
+    budget: Optional[int] = None
+    fps: int = 25
+
+    def label(self, end: datetime.date) -> str:
+        if self.name == 'weekly':
+            # week of the day before, weekly movie made on Monday belongs to the week it wraps up
+            return f'ww{(end - datetime.timedelta(days=1)).isocalendar()[1]}'
+        if self.name == 'monthly':
+            return end.strftime('%m_%Y')
+        if self.name == 'yearly':
+            return end.strftime('%Y')
+        return f'{self.name}_{end.strftime(DAY_FORMAT)}'
+
+
+PRESETS = {
+    'weekly': Timelapse('weekly', days=7, start='06:00', end='18:00', budget=6000, fps=100),
+    'monthly': Timelapse('monthly', days=30, start='06:00', end='18:00', step=10, budget=3000, fps=50),
+    'yearly': Timelapse('yearly', days=365, at='12:00', fps=25),
+}
+
+
+def seconds(value: str) -> int:
+    hours, minutes = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60
+
+
+def frame_key(day: str, second: int) -> str:
+    # sorts together with frame names of the day: dd_mm_yyyy_HH-MM-SS.jpg
+    return f'{day}_{second // 3600:02d}-{second % 3600 // 60:02d}-{second % 60:02d}'
+
+
+def frame_seconds(name: str) -> int:
+    return int(name[11:13]) * 3600 + int(name[14:16]) * 60 + int(name[17:19])
+
+
+_listing: Dict[Path, Tuple[int, List[str]]] = {}
+
+
+def list_day(folder: Path) -> List[str]:
+    """ Sorted frame names of day folder, listing is cached until folder changes
+    """
+    mtime = folder.stat().st_mtime_ns
+    cached = _listing.get(folder)
+    if cached is None or cached[0] != mtime:
+        cached = mtime, sorted(name for name in os.listdir(folder) if name.endswith('.jpg'))
+        _listing[folder] = cached
+    return cached[1]
+
+
+def nearest(names: List[str], day: str, second: int) -> Optional[int]:
+    i = bisect_left(names, frame_key(day, second))
+    candidates = [j for j in (i - 1, i) if 0 <= j < len(names)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda j: abs(frame_seconds(names[j]) - second))
+
+
+def pick_day(names: List[str], day: str, spec: Timelapse) -> List[str]:
+    start, end = seconds(spec.start), seconds(spec.end)
+    window = names[bisect_left(names, frame_key(day, start)):bisect_left(names, frame_key(day, end))]
+    if not window:
+        return []
+    if spec.at:
+        return [window[nearest(window, day, seconds(spec.at))]]
+    if not spec.step:
+        return window
+    picked = []
+    step = spec.step * 60
+    for target in range(start, end, step):
+        i = bisect_left(window, frame_key(day, target))
+        if i < len(window) and (not picked or picked[-1] != window[i]) and frame_seconds(window[i]) < target + step:
+            picked.append(window[i])
+    return picked
+
+
+def thin(sequence: list, budget: Optional[int]) -> list:
+    if not budget or len(sequence) <= budget:
+        return sequence
+    return [sequence[i * len(sequence) // budget] for i in range(budget)]
+
+
+def select(imgs: Path, spec: Timelapse, end: datetime.date) -> List[str]:
+    """ Frames for timelapse ending at `end` (inclusive), only picked names are parsed
+    """
+    sequence = []
+    for offset in range(spec.days - 1, -1, -1):
+        day = (end - datetime.timedelta(days=offset)).strftime(DAY_FORMAT)
+        folder = imgs / day
+        if not folder.is_dir():
+            continue
+        sequence.extend(str(folder / name) for name in pick_day(list_day(folder), day, spec))
+    result = thin(sequence, spec.budget)
+    logger.info(f'Selected {len(result)} of {len(sequence)} frames for {spec.name} timelapse')
+    return result
@@ -0,0 +1,145 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Dict, Optional
+
+from loguru import logger
+
+from shot import conf, metrics
+
+
+def init_worker(root_dir: str, log_file: str):
+    """ Spawned worker reads settings again, runtime changes of parent are passed explicitly
+    """
+    conf.root_dir = root_dir
+    conf.log_file = log_file
+    logger.configure(handlers=[{'sink': Path(root_dir) / log_file, 'level': 'DEBUG'}])
+
+
+def _timed(func, *args, **kwargs):
+    """ Runs in worker, returns start timestamp to measure time spent in queue
+    """
+    return time.time(), func(*args, **kwargs)
+
+
+@dataclass
+class PoolStats:
+    size: int
+    submitted: int = 0
+    pending: int = 0
+    wait_total: float = 0
+    wait_max: float = 0
+    failed: int = 0
+
+    @property
+    def queue_depth(self):
+        return max(self.pending - self.size, 0)
+
+    def as_dict(self):
+        done = self.submitted - self.pending
+        return {
+            'size': self.size,
+            'submitted': self.submitted,
+            'pending': self.pending,
+            'queue_depth': self.queue_depth,
+            'wait_avg': self.wait_total / done if done else 0,
+            'wait_max': self.wait_max,
+            'failed': self.failed,
+        }
+
+
+class Workers:
+    """ Compute subsystem shared by the whole service
+
+    `cpu` is process pool for heavy Pillow/imageio work, `io` is thread pool for blocking
+    calls (file system, subprocesses). Jobs of one camera are capped by `conf.cam_jobs`,
+    so single camera can not occupy all workers.
+    """
+
+    def __init__(self):
+        self._cpu: Optional[ProcessPoolExecutor] = None
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._cam_limits: Dict[str, asyncio.Semaphore] = {}
+        self.stats = {
+            'cpu': PoolStats(conf.cpu_workers or os.cpu_count() or 1),
+            'io': PoolStats(conf.io_workers or min(32, (os.cpu_count() or 1) + 4)),
+        }
+
+    @property
+    def cpu(self) -> ProcessPoolExecutor:
+        if self._cpu is None:
+            self._cpu = ProcessPoolExecutor(
+                max_workers=self.stats['cpu'].size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker,
+                initargs=(conf.root_dir, conf.log_file),
+            )
+        return self._cpu
+
+    @property
+    def io(self) -> ThreadPoolExecutor:
+        if self._io is None:
+            self._io = ThreadPoolExecutor(max_workers=self.stats['io'].size, thread_name_prefix='io')
+        return self._io
+
+    async def run_cpu(self, func, *args, cam: Optional[str] = None, **kwargs):
+        return await self._run('cpu', self.cpu, func, *args, cam=cam, **kwargs)
+
+    async def run_io(self, func, *args, cam: Optional[str] = None, **kwargs):
+        return await self._run('io', self.io, func, *args, cam=cam, **kwargs)
+
+    async def _run(self, name: str, executor: Executor, func, *args, cam: Optional[str] = None, **kwargs):
+        if cam is None:
+            return await self._submit(name, executor, func, *args, **kwargs)
+        if cam not in self._cam_limits:
+            self._cam_limits[cam] = asyncio.Semaphore(conf.cam_jobs)
+        async with self._cam_limits[cam]:
+            return await self._submit(name, executor, func, *args, **kwargs)
+
+    async def _submit(self, name: str, executor: Executor, func, *args, **kwargs):
+        stats = self.stats[name]
+        stats.submitted += 1
+        stats.pending += 1
+        submitted = time.time()
+        loop = asyncio.get_event_loop()
+        try:
+            started, result = await loop.run_in_executor(executor, partial(_timed, func, *args, **kwargs))
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            stats.pending -= 1
+        wait = max(started - submitted, 0)
+        stats.wait_total += wait
+        stats.wait_max = max(stats.wait_max, wait)
+        return result
+
+    async def warm(self):
+        """ Spawns worker processes ahead, so first captures do not pay for interpreter start
+        """
+        await asyncio.gather(*(self.run_cpu(os.getpid) for _ in range(self.stats['cpu'].size)))
+
+    def metrics(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def shutdown(self):
+        if self._cpu is not None:
+            self._cpu.shutdown(wait=False)
+        if self._io is not None:
+            self._io.shutdown(wait=False)
+
+
+workers = Workers()
+
+
+@metrics.register_collector
+def collect_executors():
+    for name, pool in workers.metrics().items():
+        metrics.executor_pending.set(pool['pending'], pool=name)
+        metrics.executor_queue_depth.set(pool['queue_depth'], pool=name)
+        metrics.executor_wait_seconds.set(pool['wait_avg'], pool=name)